@@ -0,0 +1,87 @@
+import tkinter as tk
+
+# Entry with an as-you-type suggestion list. complete(text, limit) is asked
+# for matches after every keystroke that changes the text, so it has to be
+# fast; the store's flavor index answers from a sorted list in well under a
+# millisecond. Down moves into the list, Tab or Enter takes the highlighted
+# suggestion (the first one from the entry), Escape closes the list.
+
+IGNORED_KEYS = {'Up', 'Down', 'Return', 'Tab', 'Escape', 'Shift_L', 'Shift_R', 'Control_L', 'Control_R'}
+
+
+class AutocompleteEntry(tk.Entry):
+    def __init__(self, master, complete, limit=8, **kwargs):
+        super().__init__(master, **kwargs)
+        self.complete = complete
+        self.limit = limit
+        self.listbox = None
+        self.last_text = None
+        self.bind('<KeyRelease>', self._typed)
+        self.bind('<Down>', self._enter_list)
+        self.bind('<Tab>', self._take_first)
+        self.bind('<Return>', self._take_first)
+        self.bind('<Escape>', lambda e: self.hide())
+        self.bind('<FocusOut>', lambda e: self.after(100, self._hide_unless_focused))
+
+    def _typed(self, event):
+        if event.keysym in IGNORED_KEYS:
+            return
+        text = self.get()
+        if text == self.last_text:
+            return
+        self.last_text = text
+        matches = self.complete(text, self.limit) if text.strip() else []
+        if not matches or matches == [text]:
+            self.hide()
+        else:
+            self.show(matches)
+
+    def show(self, matches):
+        if self.listbox is None:
+            self.listbox = tk.Listbox(self.winfo_toplevel(), exportselection=False)
+            self.listbox.bind('<ButtonRelease-1>', lambda e: self.take(self.listbox.get('active')))
+            self.listbox.bind('<Return>', lambda e: self.take(self.listbox.get('active')))
+            self.listbox.bind('<Tab>', lambda e: self.take(self.listbox.get('active')))
+            self.listbox.bind('<Escape>', lambda e: (self.hide(), self.focus_set()))
+            self.listbox.bind('<FocusOut>', lambda e: self.after(100, self._hide_unless_focused))
+        self.listbox.delete(0, 'end')
+        self.listbox.insert('end', *matches)
+        self.listbox.config(height=len(matches))
+        self.listbox.activate(0)
+        self.listbox.selection_clear(0, 'end')
+        self.listbox.selection_set(0)
+        self.listbox.place(in_=self, x=0, rely=1.0, relwidth=1.0)
+        self.listbox.lift()
+
+    def hide(self):
+        if self.listbox is not None:
+            self.listbox.place_forget()
+
+    def visible(self):
+        return self.listbox is not None and self.listbox.winfo_ismapped()
+
+    def take(self, value):
+        self.delete(0, 'end')
+        self.insert(0, value)
+        self.last_text = value
+        self.hide()
+        self.focus_set()
+        self.icursor('end')
+        return 'break'
+
+    def _enter_list(self, _):
+        if self.visible():
+            self.listbox.focus_set()
+            return 'break'
+
+    def _take_first(self, _):
+        if self.visible():
+            return self.take(self.listbox.get(0))
+
+    def _hide_unless_focused(self):
+        try:
+            focused = self.focus_get()
+        except KeyError:  # focus is in a dialog Tk cannot name
+            focused = None
+        if focused not in (self, self.listbox):
+            self.hide()
@@ -0,0 +1,235 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import storage
+from consumption import ConsumptionHistory
+from inventory_store import FREEZERS, InventoryError, InventoryStore, other_freezer
+
+# Headless benchmarks for the inventory. Builds synthetic inventories of the
+# requested sizes in a scratch directory, then for every storage format times
+# loading, saving and a replayed mix of till operations. Results go to a JSON
+# file that a later run can compare against:
+#
+#   python bench.py --sizes 100 10000 --output before.json
+#   python bench.py --sizes 100 10000 --output after.json --compare before.json
+
+DEFAULT_SIZES = [100, 1000, 10000, 100000]
+FORMATS = ['excel', 'partitioned', 'sqlite']
+# Share of each operation in the replayed mix, roughly a busy service
+OPERATION_MIX = {'use': 60, 'add': 25, 'switch': 5, 'refill': 5, 'batch': 5}
+BATCH_SIZE = 40  # a typical delivery
+REGRESSION_TOLERANCE = 0.2  # flag anything more than 20% slower
+
+
+def synthetic_quantities(size, seed=0):
+    # Every flavor is stocked in each freezer in turn, so switches merge rows
+    rng = random.Random(seed)
+    return {(FREEZERS[i % len(FREEZERS)], f"Flavor {i // len(FREEZERS):07d}"): round(rng.uniform(0, 20), 1)
+            for i in range(size)}
+
+
+def open_format(name, directory):
+    if name == 'excel':
+        return storage.ExcelBackend(os.path.join(directory, 'Inventory.xlsx'))
+    if name == 'partitioned':
+        return storage.PartitionedExcelBackend(os.path.join(directory, 'Inventory.xlsx'))
+    return storage.SqliteBackend(os.path.join(directory, 'Inventory.db'))
+
+
+def summarize(size, fmt, operation, durations, peak_bytes):
+    durations = sorted(durations)
+
+    def percentile(p):
+        return durations[min(len(durations) - 1, int(round(p / 100 * (len(durations) - 1))))] * 1000
+
+    total = sum(durations)
+    return {
+        'size': size, 'format': fmt, 'operation': operation, 'count': len(durations),
+        'mean_ms': statistics.fmean(durations) * 1000,
+        'p50_ms': percentile(50), 'p90_ms': percentile(90), 'p99_ms': percentile(99), 'max_ms': durations[-1] * 1000,
+        'ops_per_sec': len(durations) / total if total else float('inf'),
+        'peak_kib': peak_bytes / 1024,
+    }
+
+
+def timed(fn, repeats):
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        durations.append(time.perf_counter() - start)
+    return durations
+
+
+def peak_memory(fn):
+    # Separate pass, since tracemalloc slows everything down
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+class OperationMix:
+    def __init__(self, store, seed):
+        self.store = store
+        self.rng = random.Random(seed)
+        self.keys = list(store.quantities)
+
+    def key(self):
+        # Switches move rows around, so pick until we hit one that still exists
+        while True:
+            key = self.rng.choice(self.keys)
+            if key in self.store:
+                return key
+
+    def run(self, operation):
+        store, rng = self.store, self.rng
+        if operation == 'use':
+            freezer, flavor = self.key()
+            store.use(freezer, flavor, rng.uniform(0.1, 2))
+        elif operation == 'add':
+            freezer, flavor = self.key()
+            store.add(freezer, flavor, rng.uniform(1, 10))
+        elif operation == 'switch':
+            freezer, flavor = self.key()
+            store.switch(freezer, flavor)
+            self.keys.append((other_freezer(freezer), flavor))
+        elif operation == 'refill':
+            store.refill_suggestions()
+        elif operation == 'batch':
+            store.apply_batch([('add',) + self.key() + (rng.uniform(1, 10),) for _ in range(BATCH_SIZE)])
+
+    def sequence(self, count):
+        operations, weights = zip(*OPERATION_MIX.items())
+        return self.rng.choices(operations, weights, k=count)
+
+
+def bench_format(size, fmt, quantities, operations, load_repeats, directory):
+    results = []
+    backend = open_format(fmt, directory)
+    backend.save_all(quantities)
+
+    results.append(summarize(size, fmt, 'save_all', timed(lambda: backend.save_all(quantities), load_repeats),
+                             peak_memory(lambda: backend.save_all(quantities))))
+    if fmt != 'sqlite':
+        # Cold loads parse the workbooks; warm loads come from the snapshot caches
+        def cold_load():
+            for workbook in backend.partitions.values() if fmt == 'partitioned' else [backend]:
+                workbook.cache.invalidate()
+            backend.load()
+        results.append(summarize(size, fmt, 'load_cold', timed(cold_load, load_repeats), peak_memory(cold_load)))
+        backend.load()
+    results.append(summarize(size, fmt, 'load', timed(backend.load, load_repeats), peak_memory(backend.load)))
+
+    store = InventoryStore(backend=backend, history=ConsumptionHistory(os.path.join(directory, f'{fmt}.usage')))
+    mix = OperationMix(store, seed=size)
+    durations = {operation: [] for operation in OPERATION_MIX}
+    errors = 0
+    start = time.perf_counter()
+    for operation in mix.sequence(operations):
+        began = time.perf_counter()
+        try:
+            mix.run(operation)
+        except InventoryError:
+            errors += 1
+        durations[operation].append(time.perf_counter() - began)
+    elapsed = time.perf_counter() - start
+    for operation, samples in durations.items():
+        if samples:
+            peak = peak_memory(lambda: [mix.run(operation) for _ in range(min(20, len(samples)))])
+            results.append(summarize(size, fmt, operation, samples, peak))
+    mixed = summarize(size, fmt, 'mix', [d for samples in durations.values() for d in samples], 0)
+    mixed['ops_per_sec'] = operations / elapsed
+    mixed['errors'] = errors
+    results.append(mixed)
+    store.close(compact=False)
+    return results
+
+
+def run(sizes, formats, operations, load_repeats, excel_limit):
+    results = []
+    for size in sizes:
+        quantities = synthetic_quantities(size)
+        for fmt in formats:
+            if fmt != 'sqlite' and size > excel_limit:
+                print(f"skipping excel at {size} rows (over --excel-limit)", file=sys.stderr)
+                continue
+            directory = tempfile.mkdtemp(prefix='gelato-bench-')
+            try:
+                print(f"{fmt} / {size} rows ...", file=sys.stderr)
+                results.extend(bench_format(size, fmt, quantities, operations, load_repeats, directory))
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline, tolerance=REGRESSION_TOLERANCE):
+    # Returns (result, baseline result, ratio) for everything whose median got
+    # more than tolerance slower
+    previous = {(r['size'], r['format'], r['operation']): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        before = previous.get((result['size'], result['format'], result['operation']))
+        if before and before['p50_ms'] > 0:
+            ratio = result['p50_ms'] / before['p50_ms']
+            if ratio > 1 + tolerance:
+                regressions.append((result, before, ratio))
+    return regressions
+
+
+def print_table(results):
+    print(f"{'format':<11} {'rows':>8} {'operation':<10} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'ops/s':>10} {'peak KiB':>10}")
+    for r in results:
+        print(f"{r['format']:<11} {r['size']:>8} {r['operation']:<10} {r['p50_ms']:>9.3f} {r['p90_ms']:>9.3f} "
+              f"{r['p99_ms']:>9.3f} {r['ops_per_sec']:>10.1f} {r['peak_kib']:>10.1f}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='bench.py', description='Benchmark inventory operations on synthetic data')
+    parser.add_argument('--sizes', type=int, nargs='+', default=DEFAULT_SIZES,
+                        help='inventory sizes in (freezer, flavor) rows, up to 1000000')
+    parser.add_argument('--formats', nargs='+', choices=FORMATS, default=FORMATS)
+    parser.add_argument('--operations', type=int, default=2000, help='operations replayed per size and format')
+    parser.add_argument('--load-repeats', type=int, default=3, help='timed repeats of each load and save')
+    parser.add_argument('--excel-limit', type=int, default=100000,
+                        help='largest size to run against the workbook format (writing 1M rows to xlsx takes minutes)')
+    parser.add_argument('--output', default='bench_results.json')
+    parser.add_argument('--compare', metavar='BASELINE', help='earlier results file to check for regressions')
+    args = parser.parse_args(argv)
+
+    results = run(args.sizes, args.formats, args.operations, args.load_repeats, args.excel_limit)
+    report = {
+        'meta': {'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+                 'platform': platform.platform(), 'operations': args.operations, 'mix': OPERATION_MIX},
+        'results': results,
+    }
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    print_table(results)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            regressions = compare(results, json.load(f))
+        for result, before, ratio in regressions:
+            print(f"REGRESSION {result['format']} {result['size']} {result['operation']}: "
+                  f"p50 {before['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms ({ratio:.2f}x)")
+        if regressions:
+            return 1
+        print("No regressions against", args.compare)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
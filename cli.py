@@ -0,0 +1,192 @@
+import argparse
+import sys
+import instrumentation
+import inventory_store
+from inventory_store import InventoryError, InventoryLocked, InventoryStore
+
+# One-shot inventory commands for cron jobs and till integrations, e.g.
+#   python cli.py use -18 Pistachio 2
+# Runs without Tk, and with the SQLite backend (or a valid snapshot cache)
+# without loading pandas either. With --server the command goes to a running
+# server.py instead of opening the inventory files; that also happens on its
+# own when server.py is what has them open. While the shop app has them open
+# the command is refused, since the app would overwrite what it wrote.
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='cli.py', description='Gelato inventory commands')
+    parser.add_argument('--backend', choices=['partitioned', 'excel', 'sqlite'], help='storage backend (default: %(default)s)',
+                        default=inventory_store.STORAGE_BACKEND)
+    parser.add_argument('--file', help='workbook or database to use instead of the configured one')
+    parser.add_argument('--server', metavar='HOST:PORT', help='send the command to a running inventory server')
+    parser.add_argument('--stats', action='store_true', help='print the time spent in storage and pandas calls')
+    parser.add_argument('--profile', metavar='FILE', help='run under cProfile and save the stats to FILE')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    add = commands.add_parser('add', help='add gelato to a freezer')
+    add.add_argument('freezer')
+    add.add_argument('flavor')
+    add.add_argument('quantity', type=float)
+
+    use = commands.add_parser('use', help='take gelato out of a freezer')
+    use.add_argument('freezer')
+    use.add_argument('flavor')
+    use.add_argument('quantity', type=float)
+
+    receive = commands.add_parser('receive', help='add gelato wherever there is pan space')
+    receive.add_argument('flavor')
+    receive.add_argument('quantity', type=float)
+    receive.add_argument('--freezer', help='freezer to fill first')
+
+    commands.add_parser('pans', help='show pan slots in use per freezer')
+
+    switch = commands.add_parser('switch', help='move a flavor to another freezer')
+    switch.add_argument('freezer')
+    switch.add_argument('flavor')
+    switch.add_argument('--to', dest='to_freezer', help='destination freezer (default: the other one)')
+
+    clear = commands.add_parser('clear', help='set every quantity in a freezer to zero')
+    clear.add_argument('freezer')
+
+    delete = commands.add_parser('delete', help='delete every row in a freezer')
+    delete.add_argument('freezer')
+
+    show = commands.add_parser('show', help='list the inventory')
+    show.add_argument('freezer', nargs='?')
+
+    commands.add_parser('refill', help='list flavors that need a refill')
+
+    export = commands.add_parser('export', help='write a report as CSV (or JSON lines for .jsonl)')
+    export.add_argument('report', choices=['inventory', 'totals', 'low-stock', 'movements'])
+    export.add_argument('path')
+    export.add_argument('--freezer', help='only this freezer')
+    export.add_argument('--days', type=float, help='movements over the last DAYS days (default: all history)')
+
+    import_csv = commands.add_parser('import', help='apply a delivery or usage CSV as one batch')
+    import_csv.add_argument('kind', choices=['delivery', 'usage'])
+    import_csv.add_argument('path')
+    return parser
+
+
+def run(store, args):
+    if args.command == 'add':
+        quantity = store.add(args.freezer, args.flavor, args.quantity)
+        print(f"Added {args.quantity} units of {args.flavor} to freezer {args.freezer} (now {quantity}).")
+        warn_over_capacity(store)
+    elif args.command == 'use':
+        quantity = store.use(args.freezer, args.flavor, args.quantity)
+        print(f"Used {args.quantity} units of {args.flavor} from freezer {args.freezer} (now {quantity}).")
+    elif args.command == 'receive':
+        preferred = {args.flavor.strip(): args.freezer} if args.freezer else None
+        for freezer, flavor, quantity in store.receive([(args.flavor, args.quantity)], preferred):
+            print(f"Added {quantity:g} units of {flavor} to freezer {freezer}.")
+        warn_over_capacity(store)
+    elif args.command == 'pans':
+        for freezer, (used, slots) in store.pan_summary().items():
+            print(f"{freezer}: {used}/{slots} pans")
+    elif args.command == 'switch':
+        to_freezer = store.switch(args.freezer, args.flavor, args.to_freezer)
+        print(f"Switched {args.flavor} from freezer {args.freezer} to {to_freezer}.")
+    elif args.command == 'clear':
+        store.clear(args.freezer)
+        print(f"The inventory for freezer {args.freezer} has been cleared.")
+    elif args.command == 'delete':
+        store.delete(args.freezer)
+        print(f"All entries from freezer {args.freezer} have been deleted.")
+    elif args.command == 'show':
+        items = store.items() if args.freezer is None else \
+            [((args.freezer, flavor), quantity) for flavor, quantity in store.freezer_items(args.freezer)]
+        for (freezer, flavor), quantity in items:
+            print(f"{freezer}\t{flavor}\t{quantity}")
+    elif args.command == 'refill':
+        for freezer, flavors in store.refill_suggestions().items():
+            print(f"{freezer}: {', '.join(flavors)}")
+    elif args.command == 'export':
+        import reports
+        options = {'days': args.days} if args.report == 'movements' else {}
+        count = reports.export(store, args.report, args.path, freezer=args.freezer, **options)
+        print(f"Wrote {count} {args.report} rows to {args.path}.")
+    elif args.command == 'import':
+        count = store.import_movements(args.path, 'add' if args.kind == 'delivery' else 'use')
+        print(f"Imported {count} {args.kind} rows from {args.path}.")
+
+
+def warn_over_capacity(store):
+    # Pan slots are advisory, so going over them is reported rather than refused
+    for freezer, (used, slots) in store.pan_summary().items():
+        if used > slots:
+            print(f"Warning: freezer {freezer} holds {used} pans but has slots for {slots}.", file=sys.stderr)
+
+
+def freezers_needed(args):
+    # Commands about one freezer only load that freezer's partition; None loads all
+    if args.command in ('add', 'use', 'clear', 'delete') or (args.command == 'show' and args.freezer):
+        return [args.freezer.strip()]
+    if args.command == 'switch':
+        try:
+            return [args.freezer.strip(), (args.to_freezer or inventory_store.other_freezer(args.freezer.strip())).strip()]
+        except InventoryError:
+            return None  # let the command report the bad freezer
+    return None
+
+
+def open_store(args):
+    if not args.server:
+        try:
+            return InventoryStore(freezers=freezers_needed(args))
+        except InventoryLocked as e:
+            if not e.holder.get('server'):
+                raise
+            if args.command == 'export':
+                raise InventoryError("The inventory server has the inventory open and export reads the files itself; "
+                                     "stop the server first") from None
+            args.server = e.holder['server']
+            print(f"The inventory server has the inventory open; sending the command to {args.server}", file=sys.stderr)
+    from server import InventoryClient, RemoteStore, parse_address
+    return RemoteStore(InventoryClient(*parse_address(args.server)))
+
+
+def print_stats():
+    stats, counters = instrumentation.snapshot()
+    for name, stat in sorted(stats.items(), key=lambda item: -item[1]['total_ms']):
+        print(f"{name:<32} {stat['count']:>6} x {stat['mean_ms']:>9.3f} ms  (max {stat['max_ms']:.3f} ms)", file=sys.stderr)
+    for name, value in sorted(counters.items()):
+        print(f"{name:<32} {value:>6}", file=sys.stderr)
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    if args.stats:
+        instrumentation.enable()
+    if args.profile:
+        instrumentation.start_profiling()
+    inventory_store.STORAGE_BACKEND = args.backend
+    if args.file:
+        if args.backend == 'sqlite':
+            inventory_store.inventory_db = args.file
+        else:
+            inventory_store.inventory_file = args.file
+    if args.server and args.command == 'export':
+        print("Error: export reads the inventory files; run it without --server", file=sys.stderr)
+        return 2
+    try:
+        store = open_store(args)
+    except Exception as e:
+        print(f"Error: could not load the inventory: {e}", file=sys.stderr)
+        return 2
+    try:
+        run(store, args)
+    except (OSError, InventoryError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        store.close(compact=False)
+        if args.profile:
+            instrumentation.stop_profiling(args.profile)
+        if args.stats:
+            print_stats()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
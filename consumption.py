@@ -0,0 +1,157 @@
+import json
+import os
+import struct
+import time
+from filelock import FileLock
+
+# Usage history. Every "use" is appended as a fixed-size binary record
+# (timestamp, key id, amount) to a file next to the workbook, with the
+# (freezer, flavor) names for the key ids kept in a small side file. Recording
+# never reads the history back; forecasts load the whole file in one NumPy call
+# and work on columns, so they stay fast over months of records.
+
+RECORD = struct.Struct('<dId')  # seconds since the epoch, key id, amount used
+SECONDS_PER_DAY = 86400.0
+
+
+def record_dtype():
+    import numpy as np
+
+    return np.dtype([('time', '<f8'), ('key', '<u4'), ('amount', '<f8')])
+
+
+class ConsumptionHistory:
+    def __init__(self, path):
+        self.path = path
+        self.keys_path = path + '.keys'
+        self.keys = []  # key id -> (freezer, flavor)
+        self.key_ids = {}
+        self._keys_size = 0  # bytes of the keys file read into self.keys
+        self._refresh_keys()
+        self._loaded = None  # columns read from disk, once a forecast needs them
+        self._size = 0  # bytes of the history file read into them
+
+    def _refresh_keys(self):
+        # Picks up keys appended since the last read, by this or another process.
+        # A key's id is its line number, so only whole lines are taken; a torn
+        # line from a crash mid-append is cut off by the next key_id() to append.
+        try:
+            with open(self.keys_path, 'rb') as f:
+                f.seek(self._keys_size)
+                data = f.read()
+        except FileNotFoundError:
+            return
+        for line in data.splitlines(keepends=True):
+            if not line.endswith(b'\n'):
+                break
+            try:
+                freezer, flavor = json.loads(line)
+            except ValueError:
+                break
+            self.key_ids[(freezer, flavor)] = len(self.keys)
+            self.keys.append((freezer, flavor))
+            self._keys_size += len(line)
+
+    def key_id(self, key):
+        key_id = self.key_ids.get(key)
+        if key_id is None:
+            # Ids are handed out under a lock on the keys file, after reading the
+            # keys other processes added, so two tills never give one id to two keys
+            with FileLock(self.keys_path + '.lock'):
+                self._refresh_keys()
+                key_id = self.key_ids.get(key)
+                if key_id is None:
+                    key_id = len(self.keys)
+                    line = (json.dumps(list(key)) + '\n').encode('utf-8')
+                    with open(self.keys_path, 'ab') as f:
+                        f.truncate(self._keys_size)
+                        f.write(line)
+                    self._keys_size += len(line)
+                    self.key_ids[key] = key_id
+                    self.keys.append(key)
+        return key_id
+
+    def record(self, used, when=None):
+        # used maps (freezer, flavor) -> amount taken out; an undone use is
+        # recorded as a negative amount, which cancels it in every sum
+        when = time.time() if when is None else when
+        records = [(when, self.key_id(key), amount) for key, amount in used.items() if amount != 0]
+        if not records:
+            return
+        with open(self.path, 'ab') as f:
+            f.write(b''.join(RECORD.pack(*record) for record in records))
+
+    def columns(self):
+        # Reads only what was appended since the last call, including records
+        # written by other processes
+        import numpy as np
+
+        if self._loaded is None:
+            self._loaded = np.zeros(0, dtype=record_dtype())
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._size)
+                data = f.read()
+        except FileNotFoundError:
+            data = b''
+        whole = len(data) - len(data) % RECORD.size
+        if whole:
+            self._loaded = np.concatenate([self._loaded, np.frombuffer(data[:whole], dtype=record_dtype())])
+            self._size += whole
+        # Keys are written before any record that uses them
+        self._refresh_keys()
+        return self._loaded
+
+    def iter_chunks(self, records=1 << 16):
+        # Reads the history from disk records at a time, for reports that must
+        # not hold months of usage in memory at once
+        import numpy as np
+
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            while True:
+                chunk = np.fromfile(f, dtype=record_dtype(), count=records)
+                if not len(chunk):
+                    self._refresh_keys()  # names for ids another process added meanwhile
+                    return
+                yield chunk
+
+    def __len__(self):
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        return size // RECORD.size
+
+    def daily_rates(self, window_days=14, now=None):
+        # Average amount used per day for every key id over the last window_days.
+        # Keys first used inside the window are averaged over the days since their
+        # first use, so a new flavor is not diluted by days it did not exist.
+        import numpy as np
+
+        now = time.time() if now is None else now
+        data = self.columns()
+        recent = data[data['time'] >= now - window_days * SECONDS_PER_DAY]
+        totals = np.bincount(recent['key'], weights=recent['amount'], minlength=len(self.keys))
+        # Records are appended in time order, so assigning them in reverse leaves
+        # each key's earliest time in place (the last write to an index wins)
+        first_seen = np.full(len(self.keys), now)
+        first_seen[data['key'][::-1]] = data['time'][::-1]
+        days = np.clip((now - first_seen) / SECONDS_PER_DAY, 1.0, window_days)
+        return totals / days
+
+    def forecast(self, quantities, window_days=14, now=None):
+        # Days until each row runs out at its recent rate of use; rows with no
+        # recent use are left out. Returns {key: (rate per day, days to empty)}.
+        import numpy as np
+
+        rates = self.daily_rates(window_days, now)
+        keys = [key for key in quantities if key in self.key_ids]
+        if not keys:
+            return {}
+        ids = np.fromiter((self.key_ids[key] for key in keys), dtype=np.int64, count=len(keys))
+        stock = np.fromiter((quantities[key] for key in keys), dtype=np.float64, count=len(keys))
+        key_rates = rates[ids]
+        used = key_rates > 0
+        days = np.divide(stock, key_rates, out=np.full(len(keys), np.inf), where=used)
+        return {keys[i]: (float(key_rates[i]), float(days[i])) for i in np.flatnonzero(used)}
@@ -0,0 +1,69 @@
+import os
+import time
+
+# Exclusive locks on a lock file, shared between processes: fcntl.flock on
+# Linux and macOS, msvcrt.locking on Windows. The OS drops the lock when the
+# process exits, so a crash never leaves the data locked. Each FileLock opens
+# its own handle, so two locks on the same path also exclude each other within
+# one process.
+#
+#   with FileLock(path + '.lock'):
+#       ...  # read the tail, append, ...
+
+POLL_SECONDS = 0.05
+
+if os.name == 'nt':
+    import msvcrt
+
+    def _try_lock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+
+    def _unlock(f):
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+else:
+    import fcntl
+
+    def _try_lock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _unlock(f):
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+class FileLock:
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def acquire(self, timeout=None):
+        # Waits up to timeout seconds (None waits for as long as it takes);
+        # returns False if another holder still has the lock by then
+        deadline = None if timeout is None else time.monotonic() + timeout
+        f = open(self.path, 'a+b')
+        while True:
+            try:
+                _try_lock(f)
+            except OSError:
+                if deadline is not None and time.monotonic() >= deadline:
+                    f.close()
+                    return False
+                time.sleep(POLL_SECONDS)
+            else:
+                self.file = f
+                return True
+
+    def release(self):
+        if self.file is not None:
+            _unlock(self.file)
+            self.file.close()
+            self.file = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+        return False
@@ -0,0 +1,135 @@
+import bisect
+import difflib
+import heapq
+from collections import Counter
+
+# Index of every flavor name in the inventory, kept up to date by the store on
+# every change set. Prefix lookups for autocomplete are a bisect into a sorted
+# list of case-folded names (a flattened trie: every name with a given prefix
+# sits in one contiguous run). Fuzzy lookups for "did you mean" go through an
+# inverted index of character trigrams, and only the few best trigram matches
+# are scored with difflib, so neither lookup scans the whole catalog.
+
+MAX_COMPLETIONS = 8
+FUZZY_CUTOFF = 0.6  # difflib ratio a suggestion needs, as in get_close_matches
+FUZZY_CANDIDATES = 20  # trigram matches that get the full similarity score
+POSTINGS_BUDGET = 4000  # stop adding very common trigrams past this many postings
+
+
+def fold(name):
+    # Case and spacing do not matter when looking a flavor up
+    return ' '.join(name.casefold().split())
+
+
+def trigrams(folded):
+    padded = f"  {folded} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FlavorIndex:
+    def __init__(self):
+        self.keys = set()  # own copy of the (freezer, flavor) rows
+        self.rows = Counter()  # flavor -> number of freezers holding it
+        self.names = []  # sorted (folded name, flavor) pairs
+        self.grams = {}  # trigram -> set of flavors
+        self.gram_counts = {}  # flavor -> number of distinct trigrams in it
+
+    def rebuild(self, quantities):
+        self.keys = set(quantities)
+        self.rows = Counter(flavor for _, flavor in self.keys)
+        self.names = sorted((fold(flavor), flavor) for flavor in self.rows)
+        self.grams = {}
+        self.gram_counts = {}
+        for flavor in self.rows:
+            grams = trigrams(fold(flavor))
+            self.gram_counts[flavor] = len(grams)
+            for gram in grams:
+                self.grams.setdefault(gram, set()).add(flavor)
+
+    def apply_changes(self, changes):
+        # Store listener: a name is indexed while at least one freezer holds it
+        for key, quantity in changes.items():
+            flavor = key[1]
+            if quantity is None:
+                if key in self.keys:
+                    self.keys.discard(key)
+                    self.rows[flavor] -= 1
+                    if not self.rows[flavor]:
+                        del self.rows[flavor]
+                        self._remove(flavor)
+            elif key not in self.keys:
+                self.keys.add(key)
+                self.rows[flavor] += 1
+                if self.rows[flavor] == 1:
+                    self._add(flavor)
+
+    def _add(self, flavor):
+        folded = fold(flavor)
+        bisect.insort(self.names, (folded, flavor))
+        grams = trigrams(folded)
+        self.gram_counts[flavor] = len(grams)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(flavor)
+
+    def _remove(self, flavor):
+        folded = fold(flavor)
+        del self.names[bisect.bisect_left(self.names, (folded, flavor))]
+        del self.gram_counts[flavor]
+        for gram in trigrams(folded):
+            posting = self.grams[gram]
+            posting.discard(flavor)
+            if not posting:
+                del self.grams[gram]
+
+    def __contains__(self, flavor):
+        return flavor in self.rows
+
+    def __len__(self):
+        return len(self.rows)
+
+    def complete(self, prefix, limit=MAX_COMPLETIONS):
+        # Flavors starting with prefix, in alphabetical order
+        prefix = fold(prefix)
+        matches = []
+        position = bisect.bisect_left(self.names, (prefix,))
+        while len(matches) < limit and position < len(self.names):
+            folded, flavor = self.names[position]
+            if not folded.startswith(prefix):
+                break
+            matches.append(flavor)
+            position += 1
+        return matches
+
+    def similar(self, name, limit=5, accept=None):
+        # Flavors that look like name, best match first. accept(flavor) can
+        # narrow the search, e.g. to flavors stocked in one freezer.
+        query = fold(name)
+        if not query:
+            return []
+        query_grams = trigrams(query)
+        counts = Counter()
+        budget = POSTINGS_BUDGET
+        # Rare trigrams say the most about a name, so they go first
+        for posting in sorted((self.grams.get(gram, ()) for gram in query_grams), key=len):
+            if len(posting) > budget and counts:
+                break
+            counts.update(posting)
+            budget -= len(posting)
+
+        def overlap(item):
+            # Jaccard similarity of the trigram sets, so long names sharing the
+            # same trigrams rank below the closest one
+            flavor, shared = item
+            return shared / (len(query_grams) + self.gram_counts[flavor] - shared)
+
+        candidates = heapq.nlargest(FUZZY_CANDIDATES, (item for item in counts.items() if accept is None or accept(item[0])),
+                                    key=overlap)
+        matcher = difflib.SequenceMatcher()
+        matcher.set_seq2(query)
+        scored = []
+        for flavor, _ in candidates:
+            matcher.set_seq1(fold(flavor))
+            ratio = matcher.ratio()
+            if ratio >= FUZZY_CUTOFF:
+                scored.append((-ratio, flavor))
+        return [flavor for _, flavor in sorted(scored)[:limit]]
@@ -0,0 +1,138 @@
+import bisect
+import tkinter as tk
+from tkinter import ttk
+from instrumentation import timed
+
+# Virtualized freezer table. The full catalog is kept as a sorted list of keys
+# and only the rows that fit on screen exist as Treeview items; scrolling just
+# rewrites those few items. After a mutation only the changed keys are moved
+# within the sorted list, so the cost of an update does not depend on how many
+# flavors a freezer holds.
+
+COLUMNS = ('freezer', 'flavor', 'quantity')
+HEADINGS = {'freezer': 'Freezer', 'flavor': 'Flavor', 'quantity': 'Quantity'}
+
+
+class FreezerTable(tk.Frame):
+    def __init__(self, master, height=15, on_select=None):
+        super().__init__(master)
+        self.height = height
+        self.on_select = on_select
+        self.tree = ttk.Treeview(self, columns=COLUMNS, show='headings', height=height, selectmode='browse')
+        for column in COLUMNS:
+            self.tree.heading(column, text=HEADINGS[column], command=lambda c=column: self.sort_by(c))
+        self.tree.column('freezer', width=80, anchor='center')
+        self.tree.column('flavor', width=220)
+        self.tree.column('quantity', width=100, anchor='e')
+        self.scrollbar = ttk.Scrollbar(self, orient='vertical', command=self.yview)
+        self.tree.grid(row=0, column=0, sticky='nsew')
+        self.scrollbar.grid(row=0, column=1, sticky='ns')
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        # One reusable item per visible line
+        self.items = [self.tree.insert('', 'end', values=('', '', '')) for _ in range(height)]
+        self.freezer = None  # None shows every freezer
+        self.empty_message = ''  # shown on the first line when no row passes the filter
+        self.values = {}  # key -> quantity for every row that passes the filter
+        self.order = []  # sorted (sort key, key) pairs
+        self.sort_column = 'flavor'
+        self.reverse = False
+        self.offset = 0
+
+        self.tree.bind('<MouseWheel>', lambda e: self.scroll(-1 if e.delta > 0 else 1))
+        self.tree.bind('<Button-4>', lambda e: self.scroll(-1))
+        self.tree.bind('<Button-5>', lambda e: self.scroll(1))
+        self.tree.bind('<<TreeviewSelect>>', self._selected)
+
+    def sort_key(self, key, quantity):
+        freezer, flavor = key
+        if self.sort_column == 'freezer':
+            return (freezer, flavor)
+        if self.sort_column == 'quantity':
+            return (quantity, freezer, flavor)
+        return (flavor, freezer)
+
+    @timed('ui.table.show')
+    def show(self, items, freezer=None, empty_message=''):
+        # Full rebuild, used when switching between freezers
+        self.freezer = freezer
+        self.empty_message = empty_message
+        self.values = {key: quantity for key, quantity in items if freezer is None or key[0] == freezer}
+        self._resort()
+        self.offset = 0
+        self.render()
+
+    def sort_by(self, column):
+        self.reverse = not self.reverse if column == self.sort_column else False
+        self.sort_column = column
+        self._resort()
+        self.render()
+
+    def _resort(self):
+        self.order = sorted((self.sort_key(key, quantity), key) for key, quantity in self.values.items())
+
+    @timed('ui.table.apply_changes')
+    def apply_changes(self, changes):
+        # changes maps key -> new quantity, or None for a deleted row
+        moved = False
+        for key, quantity in changes.items():
+            if self.freezer is not None and key[0] != self.freezer:
+                continue
+            if key in self.values:
+                old = (self.sort_key(key, self.values[key]), key)
+                del self.order[bisect.bisect_left(self.order, old)]
+                del self.values[key]
+            if quantity is not None:
+                self.values[key] = quantity
+                bisect.insort(self.order, (self.sort_key(key, quantity), key))
+            moved = True
+        if moved:
+            self.render()
+
+    def __len__(self):
+        return len(self.order)
+
+    def row(self, position):
+        # Row at a position in display order
+        if self.reverse:
+            position = len(self.order) - 1 - position
+        return self.order[position][1]
+
+    @timed('ui.table.render')
+    def render(self):
+        self.offset = max(0, min(self.offset, len(self.order) - self.height))
+        for line, item in enumerate(self.items):
+            position = self.offset + line
+            if position < len(self.order):
+                key = self.row(position)
+                self.tree.item(item, values=(key[0], key[1], self.values[key]))
+            elif line == 0 and not self.order:
+                self.tree.item(item, values=('', self.empty_message, ''))
+            else:
+                self.tree.item(item, values=('', '', ''))
+        if self.order:
+            self.scrollbar.set(self.offset / len(self.order), min(1.0, (self.offset + self.height) / len(self.order)))
+        else:
+            self.scrollbar.set(0.0, 1.0)
+
+    def scroll(self, lines):
+        self.offset += lines
+        self.render()
+        return 'break'
+
+    def yview(self, action, amount, unit=None):
+        # Scrollbar callback: ('moveto', fraction) or ('scroll', n, 'units'/'pages')
+        if action == 'moveto':
+            self.offset = int(float(amount) * len(self.order))
+        elif action == 'scroll':
+            self.offset += int(amount) * (self.height if unit == 'pages' else 1)
+        self.render()
+
+    def _selected(self, _):
+        selection = self.tree.selection()
+        if not selection or self.on_select is None:
+            return
+        position = self.offset + self.items.index(selection[0])
+        if position < len(self.order):
+            self.on_select(self.row(position))
@@ -0,0 +1,234 @@
+import collections
+import functools
+import json
+import os
+import threading
+import time
+
+# Timing spans and counters for the hot paths: storage calls, pandas
+# conversions, worker jobs and table renders. Everything is off by default;
+# while off, span() hands back a shared do-nothing context manager and timed()
+# wrappers make a single flag check before calling straight through, so the
+# instrumented code pays next to nothing.
+#
+#   with instrumentation.span('storage.excel.write'):
+#       ...
+#
+#   @instrumentation.timed('store.apply_batch')
+#   def apply_batch(...):
+#
+# Set INVENTORY_STATS=1 in the environment (or call enable()) to start
+# recording. Aggregates are kept per name for the stats panel; individual
+# spans are buffered and appended to a rolling JSON-lines log by write_log().
+# A cProfile capture of the calling thread and of worker jobs can be started
+# and stopped at any time with start_profiling() / stop_profiling().
+
+# Rolling log of individual spans, next to the inventory
+stats_log = os.path.join('data', 'Stats.jsonl')
+LOG_MAX_BYTES = 1 << 20  # start a new file after this much
+LOG_BACKUPS = 3  # Stats.jsonl.1 ... Stats.jsonl.3
+BUFFERED_EVENTS = 10000  # spans kept in memory between log writes; older ones are dropped
+SAMPLES_PER_NAME = 512  # recent durations kept per name for percentiles
+
+enabled = os.environ.get('INVENTORY_STATS', '') not in ('', '0')
+
+
+class Stat:
+    __slots__ = ('count', 'total', 'max', 'samples')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.samples = collections.deque(maxlen=SAMPLES_PER_NAME)
+
+
+_lock = threading.Lock()
+_stats = {}  # span name -> Stat
+_counters = collections.Counter()
+_events = collections.deque(maxlen=BUFFERED_EVENTS)
+
+
+def enable():
+    global enabled
+    enabled = True
+
+
+def disable():
+    global enabled
+    enabled = False
+
+
+def record(name, seconds):
+    with _lock:
+        stat = _stats.get(name)
+        if stat is None:
+            stat = _stats[name] = Stat()
+        stat.count += 1
+        stat.total += seconds
+        stat.max = max(stat.max, seconds)
+        stat.samples.append(seconds)
+        _events.append((time.time(), name, seconds, threading.current_thread().name))
+
+
+def count(name, n=1):
+    if enabled:
+        with _lock:
+            _counters[name] += n
+
+
+class _Span:
+    __slots__ = ('name', 'start')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        record(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NoSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NO_SPAN = _NoSpan()
+
+
+def span(name):
+    return _Span(name) if enabled else _NO_SPAN
+
+
+def timed(name):
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+def snapshot():
+    # ({name: {count, total_ms, mean_ms, p95_ms, max_ms}}, {counter name: value})
+    with _lock:
+        stats = {}
+        for name, stat in _stats.items():
+            samples = sorted(stat.samples)
+            stats[name] = {
+                'count': stat.count,
+                'total_ms': stat.total * 1000,
+                'mean_ms': stat.total / stat.count * 1000,
+                'p95_ms': samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000,
+                'max_ms': stat.max * 1000,
+            }
+        return stats, dict(_counters)
+
+
+def reset():
+    with _lock:
+        _stats.clear()
+        _counters.clear()
+        _events.clear()
+
+
+def write_log(path=None):
+    # Appends the spans buffered since the last call; rolls the file over once
+    # it passes LOG_MAX_BYTES. Returns the number of spans written.
+    path = path or stats_log
+    with _lock:
+        events = list(_events)
+        _events.clear()
+    if not events:
+        return 0
+    lines = ''.join(json.dumps({'time': round(when, 6), 'name': name, 'ms': round(seconds * 1000, 4), 'thread': thread})
+                    + '\n' for when, name, seconds, thread in events)
+    try:
+        if os.path.getsize(path) >= LOG_MAX_BYTES:
+            for number in range(LOG_BACKUPS - 1, 0, -1):
+                if os.path.exists(f"{path}.{number}"):
+                    os.replace(f"{path}.{number}", f"{path}.{number + 1}")
+            os.replace(path, path + '.1')
+    except FileNotFoundError:
+        pass
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(lines)
+    return len(events)
+
+
+# Before Python 3.12 cProfile only sees the thread it was enabled on, so the
+# thread that starts profiling gets one profiler and every job run through
+# profile_call (the background worker's jobs) gets its own; stop_profiling
+# merges them all. From 3.12 a profiler sees every thread but only one may be
+# active at a time, so jobs simply run under the one already started.
+# cProfile and pstats are only imported once a capture is started.
+_profilers = []
+_main_profiler = None
+
+
+def profiling():
+    return _main_profiler is not None
+
+
+def start_profiling():
+    global _main_profiler
+    if _main_profiler is None:
+        import cProfile
+
+        _main_profiler = cProfile.Profile()
+        _profilers.append(_main_profiler)
+        _main_profiler.enable()
+
+
+def profile_call(fn, *args):
+    if _main_profiler is None:
+        return fn(*args)
+    import cProfile
+
+    profiler = cProfile.Profile()
+    try:
+        profiler.enable()
+    except ValueError:
+        return fn(*args)  # Python 3.12+: the running profiler already covers this thread
+    try:
+        return fn(*args)
+    finally:
+        profiler.disable()
+        _profilers.append(profiler)
+
+
+def stop_profiling(path=None, limit=30):
+    # Stops the capture and returns the top functions by cumulative time as
+    # text; with a path the raw stats are also dumped for snakeviz/pstats
+    global _main_profiler
+    if _main_profiler is None:
+        return ''
+    import io
+    import pstats
+
+    _main_profiler.disable()
+    _main_profiler = None
+    profilers = _profilers[:]
+    _profilers.clear()
+    out = io.StringIO()
+    stats = pstats.Stats(*profilers, stream=out)
+    if path:
+        stats.dump_stats(path)
+    stats.sort_stats('cumulative').print_stats(limit)
+    return out.getvalue()
@@ -0,0 +1,637 @@
+import json
+import os
+import sys
+import threading
+import time
+import instrumentation
+import storage
+from consumption import ConsumptionHistory
+from filelock import FileLock
+from flavor_index import FlavorIndex
+from instrumentation import timed
+from low_stock import LowStockIndex
+from pans import PanAllocator
+from sync import ChangeLog
+from undo import UndoEntry, UndoLog
+
+# GUI-free inventory logic shared by the Tk app (manage.py) and the command
+# line (cli.py). Nothing here imports tkinter, and pandas/NumPy are only
+# imported by the code paths that need them.
+
+# Constants for maximum capacities and refill threshold
+MAX_CAPACITY = 10  # Each pan can hold
+REFILL_THRESHOLD = 1  # Refill the pan when it drops to 1 or fewer units
+
+# Refill suggestions also include flavors expected to run out within this
+# many days at their average rate of use over the last FORECAST_WINDOW_DAYS
+REFILL_HORIZON_DAYS = 2
+FORECAST_WINDOW_DAYS = 14
+
+# The freezers (or other locations) a flavor can be stored in and how many
+# pans each one holds; 'switch' without a destination moves to the next one in
+# this order. Add an entry here to add a freezer. The slot counts below are
+# placeholders, not measured from any shop's freezers: set them to the real
+# number of pans before trusting the pan figures. They are advisory; receive()
+# fills the emptiest space first, but no change is refused for going over.
+FREEZER_PAN_SLOTS = {'-18': 36, '-12': 24}
+FREEZERS = list(FREEZER_PAN_SLOTS)
+
+# Every change is written through to the storage backend straight away.
+# Backends that keep a journal fold it into a fresh snapshot after this many
+# changes, after this many seconds, or when the store is closed.
+FLUSH_EVERY_CHANGES = 200
+FLUSH_INTERVAL_SECONDS = 60
+
+# Path to the Excel file
+inventory_file = os.path.join('data', 'Inventory.xlsx')
+# Path to the SQLite database used by the 'sqlite' backend
+inventory_db = os.path.join('data', 'Inventory.db')
+# Which storage backend holds the inventory: 'partitioned' (one workbook per
+# freezer in a folder next to inventory_file, started from inventory_file the
+# first time), 'excel' (inventory_file itself) or 'sqlite'
+STORAGE_BACKEND = 'partitioned'
+# Name this shop goes by in head office's consolidated view (see sync.py);
+# None uses the computer's name. Only read when the change log is created.
+SYNC_STORE_ID = None
+# How long a command waits for another one-shot command to release the data
+LOCK_WAIT_SECONDS = 10
+
+
+# Raised for anything the user can fix: unknown freezer, missing flavor, bad quantity
+class InventoryError(ValueError):
+    pass
+
+
+# Raised when a caller's expected row versions no longer match, i.e. someone
+# else changed those rows since the caller read them
+class ConflictError(InventoryError):
+    def __init__(self, message, versions):
+        super().__init__(message)
+        self.versions = versions  # the current version of every conflicting row
+
+
+# Raised when another process holds the inventory files
+class InventoryLocked(InventoryError):
+    def __init__(self, message, holder):
+        super().__init__(message)
+        self.holder = holder  # pid, program, resident and server address of that process, as far as known
+
+
+def open_storage():
+    # The data folder is created on first use, as the backends only create their own files
+    os.makedirs(os.path.dirname(inventory_db if STORAGE_BACKEND == 'sqlite' else inventory_file) or '.', exist_ok=True)
+    if STORAGE_BACKEND == 'sqlite':
+        return storage.open_backend('sqlite', inventory_db, excel_path=inventory_file)
+    return storage.open_backend(STORAGE_BACKEND, inventory_file, excel_path=inventory_file)
+
+# Only one process at a time may work on the inventory files: the Tk app or
+# server.py for as long as they run, a CLI command for the length of the
+# command. Otherwise a long-running store would compact the journal over the
+# changes another process wrote behind its back. Who holds the lock is noted
+# next to it, so a command can tell a till from a cron job, and can find the
+# server to send its command to instead.
+def lock_data(resident=False, server=None, wait=LOCK_WAIT_SECONDS):
+    # resident is True for programs that keep the inventory open; server is
+    # the address of the inventory server this process runs, if any
+    base = os.path.splitext(inventory_db if STORAGE_BACKEND == 'sqlite' else inventory_file)[0]
+    os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+    lock = FileLock(base + '.lock')
+    if not lock.acquire(0):
+        # Another command will be done in a moment; the shop app or the server will not
+        holder = read_lock_holder(base)
+        if holder.get('resident') or not lock.acquire(wait):
+            holder = read_lock_holder(base)
+            raise InventoryLocked(describe_lock_holder(holder), holder)
+    tmp_file = base + '.owner.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump({'pid': os.getpid(), 'program': os.path.basename(sys.argv[0]) or 'python',
+                   'resident': resident, 'server': server}, f)
+    os.replace(tmp_file, base + '.owner')
+    return lock
+
+def read_lock_holder(base):
+    try:
+        with open(base + '.owner', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def describe_lock_holder(holder):
+    who = f"{holder.get('program', 'another program')} (process {holder.get('pid', '?')})"
+    if holder.get('server'):
+        return f"The inventory is open in {who}; send commands to it with --server {holder['server']}"
+    if holder.get('resident'):
+        return f"The inventory is open in {who}. Close it first, or run server.py and point every till at it."
+    return f"The inventory is busy with {who}; try again in a moment."
+
+def open_history():
+    # Usage history lives next to whichever file holds the inventory
+    path = inventory_db if STORAGE_BACKEND == 'sqlite' else inventory_file
+    return ConsumptionHistory(os.path.splitext(path)[0] + '.usage')
+
+def open_change_log():
+    # Sequence-numbered change sets for sync, also next to the inventory
+    path = inventory_db if STORAGE_BACKEND == 'sqlite' else inventory_file
+    return ChangeLog(os.path.splitext(path)[0] + '.sync', SYNC_STORE_ID)
+
+# Load and save functions for inventory outside of the class
+def load_inventory():
+    backend = open_storage()
+    try:
+        return storage.frame_from_quantities(backend.load())
+    finally:
+        backend.close()
+
+
+def save_inventory(inventory_df):
+    nan_rows = inventory_df[inventory_df['Quantity'].isna()]
+    if not nan_rows.empty:
+        print("NaN values found before save:", nan_rows)
+    # Replaces the whole inventory, so it waits for (or refuses) whoever has it open
+    lock = lock_data()
+    try:
+        backend = open_storage()
+        try:
+            backend.save_all(storage.quantities_from_frame(inventory_df.fillna({'Quantity': 0})))
+        finally:
+            backend.close()
+    finally:
+        lock.release()
+
+@timed('pandas.read_movements_csv')
+def read_movements_csv(path):
+    import pandas as pd
+
+    # A delivery note or end-of-day usage sheet with Freezer, Flavor and Quantity
+    # columns. Repeated rows for the same flavor are summed in one groupby.
+    try:
+        df = pd.read_csv(path, dtype={'Freezer': str, 'Flavor': str})
+    except ValueError as e:
+        # pandas' ParserError and EmptyDataError, and UnicodeDecodeError, are all ValueErrors
+        raise InventoryError(f"Could not read {path} as a CSV file: {e}") from None
+    missing = {'Freezer', 'Flavor', 'Quantity'} - set(df.columns)
+    if missing:
+        raise InventoryError(f"{path} is missing the column(s): {', '.join(sorted(missing))}")
+    df['Freezer'] = df['Freezer'].str.strip()
+    df['Flavor'] = df['Flavor'].str.strip()
+    df['Quantity'] = pd.to_numeric(df['Quantity'], errors='coerce')
+    bad_rows = df[df['Quantity'].isna() | df['Freezer'].isna() | df['Flavor'].isna()]
+    if not bad_rows.empty:
+        raise InventoryError(f"{path} has incomplete rows at line(s) {', '.join(str(i + 2) for i in bad_rows.index[:10])}")
+    return df.groupby(['Freezer', 'Flavor'], sort=False)['Quantity'].sum()
+
+def check_freezer(freezer):
+    if freezer not in FREEZER_PAN_SLOTS:
+        raise InventoryError(f"Please enter a valid freezer temperature ({' or '.join(FREEZERS)}).")
+
+def other_freezer(freezer):
+    # Where 'switch' moves a flavor when no destination is given
+    check_freezer(freezer)
+    return FREEZERS[(FREEZERS.index(freezer) + 1) % len(FREEZERS)]
+
+def describe(operations):
+    # Undo menu label for a batch
+    if len(operations) != 1:
+        return f"{len(operations)} changes"
+    kind, freezer, *args = operations[0]
+    if kind in ('clear', 'delete'):
+        return f"{kind} freezer {freezer}"
+    return f"{kind} {args[0]}"
+
+# Resident copy of the inventory. Every read is served from memory; every
+# mutation is written through to the backend, and backends with a journal are
+# compacted in the background by the policy above.
+#
+# By default writes happen inline. Setting write_behind to a function that
+# schedules store.write_pending (the Tk app hands it to its BackgroundWorker)
+# makes mutations return as soon as memory is updated; the changes collected
+# in the meantime are written together, in order, when the job runs.
+class InventoryStore:
+    def __init__(self, backend=None, load=True, history=None, freezers=None, change_log=None, lock=None):
+        # The configured storage is locked for this process and keeps a change
+        # log for sync unless given them; a caller passing its own backend only
+        # gets the lock and the log it passes too
+        if backend is None:
+            lock = lock or lock_data()
+            backend = open_storage()
+            change_log = change_log or open_change_log()
+        self.lock = lock
+        self.backend = backend
+        self.history = history if history is not None else open_history()
+        self.change_log = change_log
+        # With a partitioned backend a short-lived caller can load just the
+        # freezers it works on; the rest are neither read, changed nor compacted
+        self.loaded_freezers = list(freezers) if freezers is not None and self.backend.partitioned else None
+        self.quantities = {}  # (freezer, flavor) -> quantity
+        self.by_freezer = {}  # freezer -> set of flavors, for per-freezer reads
+        self.pending_changes = 0
+        self.last_flush = time.monotonic()
+        self.write_behind = None
+        self.listeners = []  # called with each applied change set
+        # Every applied change set bumps version; versions remembers the version
+        # that last touched each row (deleted rows included) for optimistic updates.
+        # Counting starts from the clock in microseconds rather than 0, so versions
+        # handed out before a restart are never mistaken for newer ones.
+        self.version = self.base_version = time.time_ns() // 1000
+        self.versions = {}
+        self.low_stock = LowStockIndex(REFILL_THRESHOLD)
+        self.pans = PanAllocator(FREEZER_PAN_SLOTS, MAX_CAPACITY)
+        self.listeners.append(self.pans.apply_changes)
+        self.flavors = FlavorIndex()
+        self.listeners.append(self.flavors.apply_changes)
+        self.undo_log = UndoLog()
+        self._unwritten = {}
+        self._lock = threading.RLock()  # guards the in-memory state
+        self._io_lock = threading.Lock()  # serializes backend writes and compactions
+        self._compactor = None
+        if load:
+            self.reload()
+
+    @timed('store.reload')
+    def reload(self):
+        if self.loaded_freezers is None:
+            quantities = self.backend.load()
+        else:
+            quantities = self.backend.load_freezers(self.loaded_freezers)
+        with self._lock:
+            self.quantities = quantities
+            self.by_freezer = {}
+            for freezer, flavor in quantities:
+                self.by_freezer.setdefault(freezer, set()).add(flavor)
+            self.low_stock.rebuild(quantities)
+            self.pans.rebuild(quantities)
+            self.flavors.rebuild(quantities)
+            self.undo_log.clear()
+            # Changes journaled by earlier runs still count towards the next compaction
+            self.pending_changes = self.backend.pending_changes()
+            self.last_flush = time.monotonic()
+
+    def __contains__(self, key):
+        return key in self.quantities
+
+    def get(self, key, default=0.0):
+        return self.quantities.get(key, default)
+
+    def freezers(self):
+        with self._lock:
+            return sorted(freezer for freezer, flavors in self.by_freezer.items() if flavors)
+
+    def items(self):
+        with self._lock:
+            return sorted(self.quantities.items())
+
+    def freezer_items(self, freezer):
+        with self._lock:
+            return sorted((flavor, self.quantities[(freezer, flavor)]) for flavor in self.by_freezer.get(freezer, ()))
+
+    def apply(self, changes):
+        # changes maps (freezer, flavor) -> new quantity, or None to delete the row
+        if not changes:
+            return
+        with self._lock:
+            if self.write_behind is None:
+                # Inline writes run under the state lock, which already keeps them
+                # apart from a compaction
+                self.backend.write(changes)
+                if self.change_log is not None:
+                    self.change_log.append(changes)
+            else:
+                self._unwritten.update(changes)
+            for key, quantity in changes.items():
+                self.low_stock.update(key, self.quantities.get(key), quantity)
+            storage.apply_changes(self.quantities, changes)
+            for (freezer, flavor), quantity in changes.items():
+                if quantity is None:
+                    self.by_freezer.get(freezer, set()).discard(flavor)
+                else:
+                    self.by_freezer.setdefault(freezer, set()).add(flavor)
+            self.pending_changes += len(changes)
+            instrumentation.count('store.rows_changed', len(changes))
+            self.version += 1
+            for key in changes:
+                self.versions[key] = self.version
+            # Still under the lock, so listeners see change sets in the order they were applied
+            for listener in self.listeners:
+                listener(changes)
+        if self.write_behind is not None:
+            self.write_behind()
+
+    def subscribe(self, listener):
+        # listener(changes) runs on whichever thread applied the changes and must be quick
+        self.listeners.append(listener)
+
+    def write_pending(self):
+        # Writes every change collected since the last call as one backend write
+        with self._io_lock:
+            with self._lock:
+                changes, self._unwritten = self._unwritten, {}
+            if not changes:
+                return 0
+            try:
+                self.backend.write(changes)
+            except Exception:
+                # Keep them for the next attempt, unless a newer value has arrived since
+                with self._lock:
+                    for key, quantity in changes.items():
+                        self._unwritten.setdefault(key, quantity)
+                raise
+            # Logged once safely written, so head office never sees a change the shop lost
+            if self.change_log is not None:
+                self.change_log.append(changes)
+            return len(changes)
+
+    def row_version(self, key):
+        # base_version for rows nobody has changed since the store was started
+        return self.versions.get(key, self.base_version)
+
+    def changed_since(self, version):
+        # [(key, quantity or None if deleted)] for rows changed after version,
+        # or None when version comes from before this store was started
+        with self._lock:
+            if version < self.base_version:
+                return None
+            return [(key, self.quantities.get(key)) for key, row_version in self.versions.items() if row_version > version]
+
+    def versioned_items(self, freezer=None):
+        # [(key, quantity, row version)] read in one consistent pass
+        with self._lock:
+            items = self.items() if freezer is None else \
+                [((freezer, flavor), quantity) for flavor, quantity in self.freezer_items(freezer)]
+            return [(key, quantity, self.row_version(key)) for key, quantity in items]
+
+    def iter_rows(self, freezer=None, chunk_rows=5000):
+        # Yields (key, quantity) in key order, reading chunk_rows rows per hold
+        # of the lock so a long export never stalls the till. Rows deleted while
+        # the export runs are skipped; only the key order is copied up front.
+        with self._lock:
+            keys = sorted(self.quantities) if freezer is None else \
+                [(freezer, flavor) for flavor in sorted(self.by_freezer.get(freezer, ()))]
+        for start in range(0, len(keys), chunk_rows):
+            with self._lock:
+                chunk = [(key, self.quantities.get(key)) for key in keys[start:start + chunk_rows]]
+            for key, quantity in chunk:
+                if quantity is not None:
+                    yield key, quantity
+
+    def complete_flavor(self, prefix, limit=8):
+        # Flavor names starting with prefix, ignoring case, for autocomplete
+        with self._lock:
+            return self.flavors.complete(prefix, limit)
+
+    def similar_flavors(self, flavor, freezer=None, limit=5):
+        # Known flavors that look like a mistyped one, best match first;
+        # with a freezer, only flavors stocked there
+        with self._lock:
+            accept = None if freezer is None else (lambda name: (freezer, name) in self.quantities)
+            return self.flavors.similar(flavor, limit, accept)
+
+    def _not_found(self, freezer, flavor):
+        message = f"{flavor} not found in freezer {freezer}"
+        matches = self.similar_flavors(flavor, freezer, limit=1)
+        if matches:
+            message += f" (did you mean {matches[0]}?)"
+        return InventoryError(message)
+
+    def pan_summary(self):
+        with self._lock:
+            return self.pans.summary()
+
+    @timed('store.apply_batch')
+    def apply_batch(self, operations, expect=None, label=None):
+        # Applies a list of operations as one change set with one backend write.
+        # Either every operation succeeds or nothing is changed; the InventoryError
+        # names the first operation that failed.
+        #   ('add', freezer, flavor, quantity)
+        #   ('use', freezer, flavor, quantity)
+        #   ('set', freezer, flavor, quantity)
+        #   ('switch', freezer, flavor, to_freezer)
+        #   ('clear', freezer)
+        #   ('delete', freezer)
+        # expect optionally maps keys to the row versions the caller last saw;
+        # if any of them has moved on, ConflictError is raised and nothing changes.
+        # The batch can be undone as one step, under label in the undo menu.
+        # Staging reads and the final apply happen under one lock, so a batch
+        # running on the worker thread cannot interleave with a click
+        with self._lock:
+            if expect:
+                stale = {key: self.row_version(key) for key, version in expect.items() if self.row_version(key) != version}
+                if stale:
+                    names = ', '.join(f"{flavor} in {freezer}" for freezer, flavor in stale)
+                    raise ConflictError(f"Changed by someone else in the meantime: {names}", stale)
+            staged = {}
+            used = {}  # amount actually taken out per key, for the usage history
+
+            def current(key):
+                return staged[key] if key in staged else self.quantities.get(key)
+
+            def freezer_keys(freezer):
+                keys = {(freezer, flavor) for flavor in self.by_freezer.get(freezer, ())}
+                keys.update(key for key in staged if key[0] == freezer)
+                return sorted(key for key in keys if current(key) is not None)
+
+            def check_loaded(freezer):
+                if self.loaded_freezers is not None and freezer not in self.loaded_freezers:
+                    raise InventoryError(f"Freezer {freezer} is not loaded")
+
+            for number, operation in enumerate(operations, 1):
+                kind, freezer, *args = operation
+                try:
+                    check_loaded(freezer)
+                    if kind == 'add':
+                        flavor, quantity = args
+                        check_freezer(freezer)
+                        if not quantity >= 0:
+                            raise InventoryError("quantity must be a number of zero or more")
+                        staged[(freezer, flavor)] = (current((freezer, flavor)) or 0.0) + quantity
+                    elif kind == 'use':
+                        flavor, quantity = args
+                        if not quantity >= 0:
+                            raise InventoryError("quantity must be a number of zero or more")
+                        if current((freezer, flavor)) is None:
+                            raise self._not_found(freezer, flavor)
+                        available = current((freezer, flavor))
+                        staged[(freezer, flavor)] = max(available - quantity, 0)
+                        used[(freezer, flavor)] = used.get((freezer, flavor), 0.0) + min(available, quantity)
+                    elif kind == 'set':
+                        flavor, quantity = args
+                        check_freezer(freezer)
+                        if not quantity >= 0:
+                            raise InventoryError("quantity must be a number of zero or more")
+                        staged[(freezer, flavor)] = quantity
+                    elif kind == 'switch':
+                        flavor, to_freezer = args
+                        check_freezer(to_freezer)
+                        check_loaded(to_freezer)
+                        quantity = current((freezer, flavor))
+                        if quantity is None:
+                            raise self._not_found(freezer, flavor)
+                        if to_freezer != freezer:
+                            staged[(freezer, flavor)] = None
+                            staged[(to_freezer, flavor)] = (current((to_freezer, flavor)) or 0.0) + quantity
+                    elif kind in ('clear', 'delete'):
+                        keys = freezer_keys(freezer)
+                        if not keys:
+                            raise InventoryError(f"No inventory found for freezer {freezer}")
+                        for key in keys:
+                            staged[key] = 0.0 if kind == 'clear' else None
+                    else:
+                        raise InventoryError(f"unknown operation {kind!r}")
+                except (TypeError, ValueError) as e:
+                    if len(operations) == 1:
+                        raise InventoryError(str(e)) from None
+                    raise InventoryError(f"Operation {number} {operation!r} failed: {e}") from None
+            # Rows that end up back where they started need no write
+            changes = {key: quantity for key, quantity in staged.items() if self.quantities.get(key) != quantity}
+            before = {key: self.quantities.get(key) for key in changes}
+            self.apply(changes)
+            self.history.record(used)
+            if changes:
+                self.undo_log.record(UndoEntry(label or describe(operations), before, changes, used))
+            return changes
+
+    def undo(self):
+        # Reverts the latest change set and returns its label. Raises
+        # ConflictError, leaving everything as it is, when a row it touched has
+        # been changed again since, e.g. by another till.
+        with self._lock:
+            if not self.undo_log.undo_stack:
+                raise InventoryError("Nothing to undo")
+            entry = self.undo_log.undo_stack[-1]
+            self.revert(entry.label, entry.after, entry.before, entry.used, -1)
+            self.undo_log.redo_stack.append(self.undo_log.undo_stack.pop())
+            return entry.label
+
+    def redo(self):
+        with self._lock:
+            if not self.undo_log.redo_stack:
+                raise InventoryError("Nothing to redo")
+            entry = self.undo_log.redo_stack[-1]
+            self.revert(entry.label, entry.before, entry.after, entry.used, 1)
+            self.undo_log.undo_stack.append(self.undo_log.redo_stack.pop())
+            return entry.label
+
+    def revert(self, label, expected, target, used, sign):
+        # Moves the rows from expected to target unless one of them has changed
+        # since; sign is -1 for an undo and 1 for a redo. Also what the server
+        # runs for a till's undo, since the till keeps its own undo log.
+        with self._lock:
+            stale = {key: self.row_version(key) for key, quantity in expected.items() if self.quantities.get(key) != quantity}
+            if stale:
+                names = ', '.join(f"{flavor} in {freezer}" for freezer, flavor in stale)
+                action = 'undo' if sign < 0 else 'redo'
+                raise ConflictError(f"Cannot {action} {label}; changed since: {names}", stale)
+            self.apply(target)
+            # Usage taken back out on undo, and in again on redo, keeps the forecasts honest
+            self.history.record({key: sign * amount for key, amount in used.items()})
+
+    # Single operations, each one a batch of one
+
+    def add(self, freezer, flavor, quantity):
+        self.apply_batch([('add', freezer.strip(), flavor.strip(), quantity)])
+        return self.get((freezer.strip(), flavor.strip()))
+
+    def use(self, freezer, flavor, quantity):
+        self.apply_batch([('use', freezer.strip(), flavor.strip(), quantity)])
+        return self.get((freezer.strip(), flavor.strip()))
+
+    def switch(self, freezer, flavor, to_freezer=None):
+        freezer = freezer.strip()
+        to_freezer = to_freezer.strip() if to_freezer else other_freezer(freezer)
+        self.apply_batch([('switch', freezer, flavor.strip(), to_freezer)])
+        return to_freezer
+
+    def plan_delivery(self, deliveries, preferred=None):
+        # Where receive() would put incoming (flavor, quantity) pairs, without
+        # adding anything; preferred maps a flavor to the freezer to try first
+        for _, quantity in deliveries:
+            if not quantity >= 0:
+                raise InventoryError("quantity must be a number of zero or more")
+        with self._lock:
+            return self.pans.plan([(flavor.strip(), quantity) for flavor, quantity in deliveries], preferred)
+
+    def receive(self, deliveries, preferred=None):
+        # Packs incoming (flavor, quantity) pairs into pans across the freezers
+        # and adds them as one batch; returns the (freezer, flavor, quantity)
+        # placements
+        with self._lock:
+            placements = self.plan_delivery(deliveries, preferred)
+            self.apply_batch([('add', freezer, flavor, quantity) for freezer, flavor, quantity in placements],
+                             label='receive ' + ', '.join(flavor for flavor, _ in deliveries))
+            return placements
+
+    def clear(self, freezer):
+        return len(self.apply_batch([('clear', freezer.strip())]))
+
+    def delete(self, freezer):
+        return len(self.apply_batch([('delete', freezer.strip())]))
+
+    @timed('store.forecast')
+    def forecast(self):
+        # {key: (average use per day, days until empty)} for every row used recently
+        with self._lock:
+            return self.history.forecast(self.quantities, FORECAST_WINDOW_DAYS)
+
+    def refill_suggestions(self):
+        # Everything at or below REFILL_THRESHOLD plus everything predicted to run
+        # out within REFILL_HORIZON_DAYS, soonest first in each freezer
+        return self.refill_report()[0]
+
+    @timed('store.refill_suggestions')
+    def refill_report(self):
+        # The refill suggestions and the forecast they were ranked by, worked out
+        # once, for callers that show both
+        with self._lock:
+            forecast = self.forecast()
+            candidates = {(freezer, flavor) for freezer, flavors in self.low_stock.low.items() for flavor in flavors}
+            candidates.update(key for key, (_, days) in forecast.items() if days <= REFILL_HORIZON_DAYS)
+        suggestions = {}
+        ranked = sorted(candidates, key=lambda key: (forecast.get(key, (0.0, float('inf')))[1], self.get(key), key))
+        for freezer, flavor in ranked:
+            suggestions.setdefault(freezer, []).append(flavor)
+        return dict(sorted(suggestions.items())), forecast
+
+    def import_movements(self, path, kind):
+        # kind is 'add' for a delivery and 'use' for end-of-day usage
+        totals = read_movements_csv(path)
+        operations = [(kind, freezer, flavor, float(quantity)) for (freezer, flavor), quantity in totals.items()]
+        self.apply_batch(operations, label=f"import {'delivery' if kind == 'add' else 'usage'} CSV")
+        return len(operations)
+
+    def should_flush(self):
+        if not self.pending_changes or self.compacting():
+            return False
+        return (self.pending_changes >= FLUSH_EVERY_CHANGES
+                or time.monotonic() - self.last_flush >= FLUSH_INTERVAL_SECONDS)
+
+    def compacting(self):
+        return self._compactor is not None and self._compactor.is_alive()
+
+    @timed('store.flush')
+    def flush(self, wait=True):
+        # Fold the backend's journal into a fresh snapshot. With wait=False the
+        # snapshot is written on a background thread and the caller carries on.
+        if self._compactor is not None:
+            self._compactor.join()
+            self._compactor = None
+        # Anything still waiting for the worker has to reach the journal first
+        self.write_pending()
+        with self._io_lock, self._lock:
+            self.pending_changes = 0
+            self.last_flush = time.monotonic()
+            if not self.backend.start_compaction(self.loaded_freezers):
+                return
+            snapshot = dict(self.quantities)
+        if wait:
+            self.backend.finish_compaction(snapshot)
+        else:
+            self._compactor = threading.Thread(target=self.backend.finish_compaction, args=(snapshot,), daemon=True)
+            self._compactor.start()
+
+    def close(self, compact=True):
+        # Short-lived callers such as the CLI pass compact=False and leave the
+        # journal to be folded in once enough changes have piled up
+        if compact or self.pending_changes >= FLUSH_EVERY_CHANGES:
+            self.flush()
+        self.backend.close()
+        if self.lock is not None:
+            self.lock.release()
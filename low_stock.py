@@ -0,0 +1,40 @@
+# Flavors at or below the refill threshold, kept up to date by the store on
+# every quantity change. Refill queries only touch the low rows, and listeners
+# are told whenever a row crosses the threshold in either direction.
+
+
+class LowStockIndex:
+    def __init__(self, threshold):
+        self.threshold = threshold
+        self.low = {}  # freezer -> set of low flavors
+        self.listeners = []  # listener(key, quantity, is_low)
+
+    def is_low(self, quantity):
+        return quantity is not None and quantity <= self.threshold
+
+    def rebuild(self, quantities):
+        self.low = {}
+        for (freezer, flavor), quantity in quantities.items():
+            if self.is_low(quantity):
+                self.low.setdefault(freezer, set()).add(flavor)
+
+    def update(self, key, old, new):
+        # old/new are the quantities before and after; None means no such row
+        was_low, now_low = self.is_low(old), self.is_low(new)
+        if was_low == now_low:
+            return
+        freezer, flavor = key
+        if now_low:
+            self.low.setdefault(freezer, set()).add(flavor)
+        else:
+            flavors = self.low[freezer]
+            flavors.discard(flavor)
+            if not flavors:
+                del self.low[freezer]
+        # A deleted row simply leaves the index; only real stock movements are announced
+        if new is not None:
+            for listener in self.listeners:
+                listener(key, new, now_low)
+
+    def subscribe(self, listener):
+        self.listeners.append(listener)
@@ -1,53 +1,196 @@
+import functools
+import sys
+import threading
 import tkinter as tk
-from tkinter import messagebox
-import pandas as pd
-
-# Constants for maximum capacities and refill threshold
-MAX_CAPACITY = 10  # Each pan can hold
-REFILL_THRESHOLD = 1  # Refill the pan when it drops to 1 or fewer units
-
-# Path to the Excel file
-inventory_file = 'data\Inventory.xlsx' 
-
-# Load and save functions for inventory outside of the class
-def load_inventory():
-    try:
-        # Adjust this according to your Excel file's structure
-        df = pd.read_excel(inventory_file, index_col=[0, 1])
-        df['Quantity'] = pd.to_numeric(df['Quantity'], errors='coerce').fillna(0).astype(float)
-        # make sure nan is not showed
-        nan_rows = df[df['Quantity'].isna()]
-        if not nan_rows.empty:
-            print("NaN values found on load:", nan_rows)
-        df = df.fillna({'Quantity': 0})
-        # Ensure that 'Freezer' column is of type string
-        df.index = pd.MultiIndex.from_arrays([df.index.get_level_values(0).astype(str), df.index.get_level_values(1)])
-    except FileNotFoundError:
-        df = pd.DataFrame(columns=['Freezer', 'Flavor', 'Quantity'])
-        df.set_index(['Freezer', 'Flavor'], inplace=True)
-    except Exception as e:
-        messagebox.showerror("Error", f"An error occurred while loading the inventory: {e}")
-    return df
-
-
-def save_inventory(inventory_df):
-    nan_rows = inventory_df[inventory_df['Quantity'].isna()]
-    if not nan_rows.empty:
-        print("NaN values found before save:", nan_rows)
-    inventory_df.to_excel(inventory_file)
+from tkinter import filedialog, messagebox
+import instrumentation
+import reports
+# The inventory logic lives in inventory_store; load/save and the constants are
+# still importable from here for older scripts
+from inventory_store import (FREEZERS, MAX_CAPACITY, REFILL_THRESHOLD, InventoryError, InventoryLocked, InventoryStore,
+                             load_inventory, lock_data, save_inventory)
+from autocomplete import AutocompleteEntry
+from freezer_view import FreezerTable
+from stats_view import StatsWindow
+from worker import BackgroundWorker
 
 # GUI Application
 class InventoryApp(tk.Tk):
-    def __init__(self):
+    def __init__(self, server=None):
         super().__init__()
         self.title('Gelato Inventory Management')
         self.geometry('1000x800')  # Set the window size
-        self.inventory = load_inventory()  # Initialize the inventory
+        # Disk I/O and pandas work run on the worker; results come back through poll_worker
+        self.worker = BackgroundWorker()
+        # Reports get a thread of their own, so a long export never holds up saving
+        self.export_worker = BackgroundWorker(name='export-worker')
+        try:
+            self.store = self.open_store(server)
+        except InventoryLocked as e:
+            messagebox.showerror("Inventory in use", str(e))
+            self.destroy()
+            raise SystemExit(1)
+        except InventoryError as e:
+            messagebox.showerror("Error", str(e))
+            self.destroy()
+            raise SystemExit(1)
+        if self.server is None:
+            self.store.write_behind = lambda: self.worker.submit(self.store.write_pending, coalesce='write',
+                                                                 errback=self.on_worker_error)
+        # Changed rows are collected here (from any thread) and drawn by poll_worker
+        self.changed_rows = {}
+        self.changed_rows_lock = threading.Lock()
+        self.store.subscribe(self.rows_changed)
+        self.low_stock_alerts = []
+        self.store.low_stock.subscribe(self.low_stock_crossed)
         self.create_widgets()  # Build the UI components
+        self.set_buttons_state('disabled')  # until the inventory has loaded
+        self.loading = True  # the status line says so until then, not "Saving..."
+        self.status_var.set('Loading inventory...')
+        self.worker.submit(self.store.reload, callback=self.on_loaded, errback=self.on_load_error)
+        self.protocol('WM_DELETE_WINDOW', self.on_close)
+        self.after(50, self.poll_worker)
+        self.after(1000, self.flush_tick)
+
+    def open_store(self, server):
+        # The app keeps the inventory files to itself until it is closed. When
+        # server.py has them (or one is given) it works on a mirror of the server's
+        # inventory instead, which also sees what the other tills change.
+        self.server = server
+        if server is None:
+            try:
+                return InventoryStore(load=False, lock=lock_data(resident=True))
+            except InventoryLocked as e:
+                if not e.holder.get('server'):
+                    raise
+                self.server = e.holder['server']
+        from server import MirroredStore
+        self.title(f'Gelato Inventory Management ({self.server})')
+        return MirroredStore.connect(self.server)
+
+    def on_loaded(self, _):
+        self.loading = False
+        self.set_buttons_state('normal')
+        self.show_inventory()
+        self.show_pan_usage()
+
+    @instrumentation.timed('ui.pan_usage')
+    def show_pan_usage(self):
+        usage = self.store.pan_summary()
+        self.pans_var.set('Pans in use: ' + ', '.join(f"{freezer}: {used}/{slots}" + (' (over)' if used > slots else '')
+                                                     for freezer, (used, slots) in usage.items()))
+
+    def on_load_error(self, e):
+        self.loading = False
+        messagebox.showerror("Error", f"An error occurred while loading the inventory: {e}")
+
+    def on_worker_error(self, e):
+        messagebox.showerror("Error", f"Could not save the inventory: {e}")
+
+    def run_change(self, fn, *args, done, failed=None):
+        # Through the server every change is a round trip, which would freeze the
+        # window while it lasts (for the whole timeout when the server is down), so
+        # it runs on the worker and done() gets its result once the server answers.
+        # Locally a change only touches memory; saving it is already on the worker.
+        def on_error(e):
+            if not isinstance(e, InventoryError):
+                raise e
+            if failed is not None:
+                failed(e)
+            else:
+                messagebox.showerror("Error", str(e))
+
+        if self.server is not None:
+            self.worker.submit(fn, *args, callback=done, errback=on_error)
+            return
+        try:
+            result = fn(*args)
+        except InventoryError as e:
+            on_error(e)
+            return
+        done(result)
+
+    def set_buttons_state(self, state):
+        for button in self.action_buttons:
+            button.config(state=state)
+
+    def poll_worker(self):
+        try:
+            self.export_worker.poll()
+            self.worker.poll()
+            with self.changed_rows_lock:
+                changes, self.changed_rows = self.changed_rows, {}
+            if changes:
+                self.freezer_table.apply_changes(changes)
+                self.show_pan_usage()
+                self.update_undo_buttons()
+        finally:
+            pending = self.worker.pending()
+            with self.changed_rows_lock:
+                alerts, self.low_stock_alerts = self.low_stock_alerts, []
+            if alerts:
+                self.alert_var.set(' | '.join(alerts[-3:]))
+            if self.loading:
+                pass  # the reload job is pending too; keep "Loading inventory..."
+            elif pending:
+                self.status_var.set(f"Saving... ({pending} pending)")
+            elif self.status_var.get() != 'All changes saved':
+                self.status_var.set('All changes saved')
+            self.after(50, self.poll_worker)
+
+    def rows_changed(self, changes):
+        with self.changed_rows_lock:
+            self.changed_rows.update(changes)
+
+    def low_stock_crossed(self, key, quantity, is_low):
+        freezer, flavor = key
+        message = f"Refill {flavor} in {freezer} (down to {quantity})" if is_low else f"{flavor} in {freezer} restocked"
+        with self.changed_rows_lock:
+            self.low_stock_alerts.append(message)
+
+    def changed(self):
+        # Called after every mutation; compacts once enough changes have piled up
+        if self.store.should_flush():
+            self.worker.submit(self.store.flush, coalesce='flush', errback=self.on_worker_error)
+
+    def flush_tick(self):
+        self.changed()
+        if self.server is not None:
+            self.worker.submit(self.store.poll_server, coalesce='poll', errback=self.on_poll_error)
+        if instrumentation.enabled:
+            self.worker.submit(instrumentation.write_log, coalesce='stats-log', errback=self.on_stats_log_error)
+        self.after(1000, self.flush_tick)
+
+    def on_poll_error(self, e):
+        # Tried again on the next tick; no dialog every second while the server is down
+        self.alert_var.set(f"Could not reach the inventory server: {e}")
+
+    def on_stats_log_error(self, e):
+        # Losing timings is not worth interrupting the shift for
+        print("Could not write the stats log:", e, file=sys.stderr)
+
+    def open_stats(self):
+        if self.stats_window is None or not self.stats_window.winfo_exists():
+            self.stats_window = StatsWindow(self)
+        self.stats_window.lift()
+
+    def on_close(self):
+        # The worker keeps running until the close has gone through, so if the
+        # user decides to stay, saving carries on as before
+        try:
+            self.export_worker.wait()  # lets a running export finish writing its file
+            self.worker.wait()  # lets queued writes finish
+            self.store.close()
+        except Exception as e:
+            if not messagebox.askyesno("Error", f"Could not save the inventory: {e}\nClose anyway?"):
+                return
+        self.export_worker.stop()
+        self.worker.stop()
+        self.destroy()
 
     def create_widgets(self):
         # Freezer selection
-        tk.Label(self, text='Select Freezer (-18 or -12):').grid(row=0, column=0, sticky='w')
+        tk.Label(self, text=f"Select Freezer ({' or '.join(FREEZERS)}):").grid(row=0, column=0, sticky='w')
         self.freezer_var = tk.StringVar(self)
         self.freezer_entry = tk.Entry(self, textvariable=self.freezer_var)
         self.freezer_entry.grid(row=0, column=1)
@@ -55,7 +198,7 @@ class InventoryApp(tk.Tk):
         # Flavor entry
         tk.Label(self, text='Enter Flavor:').grid(row=1, column=0, sticky='w')
         self.flavor_var = tk.StringVar(self)
-        self.flavor_entry = tk.Entry(self, textvariable=self.flavor_var)
+        self.flavor_entry = AutocompleteEntry(self, self.store.complete_flavor, textvariable=self.flavor_var)
         self.flavor_entry.grid(row=1, column=1)
 
         # Quantity entry
@@ -64,8 +207,8 @@ class InventoryApp(tk.Tk):
         self.quantity_entry = tk.Entry(self, textvariable=self.quantity_var)
         self.quantity_entry.grid(row=2, column=1)
 
-        self.freezer_content_text = tk.Text(self, height=15, width=50)
-        self.freezer_content_text.grid(row=5, column=0, columnspan=4)
+        self.freezer_table = FreezerTable(self, height=15, on_select=self.row_selected)
+        self.freezer_table.grid(row=5, column=0, columnspan=4, sticky='nsew')
 
         # Buttons
         self.add_button = tk.Button(self, text='Add Gelato', command=self.add_gelato_cmd)
@@ -74,65 +217,140 @@ class InventoryApp(tk.Tk):
         self.use_button.grid(row=3, column=1)
         self.refill_button = tk.Button(self, text='Get Refill Suggestions', command=self.refill_suggestions_cmd)
         self.refill_button.grid(row=4, column=0, columnspan=2)
-        self.show_neg_18_button = tk.Button(self, text='Show -18 Freezer Contents', command=lambda: self.update_freezer_display('-18'))
-        self.show_neg_18_button.grid(row=6, column=0)
-        self.show_neg_12_button = tk.Button(self, text='Show -12 Freezer Contents', command=lambda: self.update_freezer_display('-12'))
-        self.show_neg_12_button.grid(row=6, column=1)
+        # One button per configured freezer
+        show_buttons = tk.Frame(self)
+        show_buttons.grid(row=6, column=0, columnspan=4)
+        self.show_freezer_buttons = []
+        for freezer in FREEZERS:
+            button = tk.Button(show_buttons, text=f'Show {freezer} Freezer Contents',
+                               command=lambda f=freezer: self.update_freezer_display(f))
+            button.pack(side='left')
+            self.show_freezer_buttons.append(button)
         self.clear_inventory_button = tk.Button(self, text='Clear Freezer Inventory', command=self.clear_inventory_cmd)
         self.clear_inventory_button.grid(row=7, column=0, columnspan=2)
         self.delete_button = tk.Button(self, text='Delete Gelato', command=self.delete_row_cmd)
         self.delete_button.grid(row=4, column=2, columnspan=2)
         self.switch_button = tk.Button(self, text='Switch Freezer', command=self.switch_freezer_cmd)
         self.switch_button.grid(row=8, column=0, columnspan=2)
+        self.import_delivery_button = tk.Button(self, text='Import Delivery CSV', command=lambda: self.import_movements_cmd('add'))
+        self.import_delivery_button.grid(row=9, column=0)
+        self.import_usage_button = tk.Button(self, text='Import Usage CSV', command=lambda: self.import_movements_cmd('use'))
+        self.import_usage_button.grid(row=9, column=1)
+        # Always available, also while the inventory is still loading
+        self.stats_window = None
+        tk.Button(self, text='Performance Stats', command=self.open_stats).grid(row=9, column=2)
+        # Reports are streamed to a file on the worker
+        self.report_var = tk.StringVar(self, value='inventory')
+        tk.OptionMenu(self, self.report_var, *reports.REPORTS).grid(row=13, column=0)
+        self.export_button = tk.Button(self, text='Export Report', command=self.export_report_cmd)
+        self.export_button.grid(row=13, column=1)
+        self.undo_button = tk.Button(self, text='Undo', command=self.undo_cmd, state='disabled')
+        self.undo_button.grid(row=3, column=2)
+        self.redo_button = tk.Button(self, text='Redo', command=self.redo_cmd, state='disabled')
+        self.redo_button.grid(row=3, column=3)
+        self.bind('<Control-z>', lambda e: self.undo_cmd())
+        self.bind('<Control-y>', lambda e: self.redo_cmd())
+        self.action_buttons = [self.add_button, self.use_button, self.refill_button, *self.show_freezer_buttons,
+                               self.clear_inventory_button, self.delete_button, self.switch_button,
+                               self.import_delivery_button, self.import_usage_button, self.export_button]
+
+        # Pending background work
+        self.status_var = tk.StringVar(self)
+        tk.Label(self, textvariable=self.status_var).grid(row=10, column=0, columnspan=4, sticky='w')
+        self.pans_var = tk.StringVar(self)
+        tk.Label(self, textvariable=self.pans_var).grid(row=12, column=0, columnspan=4, sticky='w')
+        # Latest low-stock notifications
+        self.alert_var = tk.StringVar(self)
+        tk.Label(self, textvariable=self.alert_var, fg='red').grid(row=11, column=0, columnspan=4, sticky='w')
 
     def update_freezer_display(self, freezer_temp):
-        self.freezer_content_text.delete('1.0', tk.END)  # Clear the current contents
-        inventory_df = load_inventory()
+        # Only the rows of that freezer are read
+        # The status line belongs to poll_worker, so an empty freezer is reported in the table
+        self.freezer_table.show(self.store.iter_rows(freezer_temp), freezer=freezer_temp,
+                                empty_message=f"Freezer {freezer_temp} not found.")
 
-        try:
-           display_contents = inventory_df.xs(freezer_temp, level='Freezer', drop_level=False)
-           for index, row in display_contents.iterrows():
-               flavor_name = index[1]
-               self.freezer_content_text.insert(tk.END, f"Flavor: {flavor_name}, Quantity: {row['Quantity']}\n")
-        except KeyError:
-           self.freezer_content_text.insert(tk.END, f"Freezer {freezer_temp} not found.\n")
-
-    
+    def row_selected(self, key):
+        # Clicking a row fills in the freezer and flavor fields
+        self.freezer_var.set(key[0])
+        self.flavor_var.set(key[1])
 
     def add_gelato_cmd(self):
         freezer = self.freezer_var.get().strip()
         flavor = self.flavor_var.get().strip()
-        if freezer not in ['-18', '-12']:
-           messagebox.showerror("Error", "Please enter a valid freezer temperature (-18 or -12).")
+        if freezer not in FREEZERS:
+           messagebox.showerror("Error", f"Please enter a valid freezer temperature ({' or '.join(FREEZERS)}).")
            return
         try:
             quantity = float(self.quantity_var.get())
-            self.add_gelato(freezer, flavor, quantity)
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number for quantity.")
+            return
+        self.add_gelato(freezer, self.resolve_new_flavor(flavor), quantity)
 
     def use_gelato_cmd(self):
         freezer = self.freezer_var.get().strip()
         flavor = self.flavor_var.get().strip()
-        if freezer not in ['-18', '-12']:
-           messagebox.showerror("Error", "Please enter a valid freezer temperature (-18 or -12).")
+        if freezer not in FREEZERS:
+           messagebox.showerror("Error", f"Please enter a valid freezer temperature ({' or '.join(FREEZERS)}).")
            return
         try:
             quantity = float(self.quantity_var.get())
-            self.use_gelato(freezer, flavor, quantity)
         except ValueError:
             messagebox.showerror("Error", "Please enter a valid number for quantity.")
+            return
+        flavor = self.resolve_flavor(freezer, flavor)
+        if flavor is not None:
+            self.use_gelato(freezer, flavor, quantity)
+
+    def resolve_flavor(self, freezer, flavor):
+        # Offers the closest flavor stocked in the freezer when the one typed is
+        # not there; returns the flavor to go ahead with, or None to stop
+        if (freezer, flavor) in self.store:
+            return flavor
+        matches = self.store.similar_flavors(flavor, freezer, limit=1)
+        if not matches:
+            return flavor  # the store reports it as not found
+        if not messagebox.askyesno("Did you mean...", f"{flavor} is not in freezer {freezer}. Did you mean {matches[0]}?"):
+            return None
+        self.flavor_var.set(matches[0])
+        return matches[0]
+
+    def resolve_new_flavor(self, flavor):
+        # Adding a misspelled flavor would start a new row, so check first
+        if flavor in self.store.flavors:
+            return flavor
+        matches = self.store.similar_flavors(flavor, limit=1)
+        if matches and messagebox.askyesno("Did you mean...", f"{flavor} is not stocked yet. Did you mean {matches[0]}?"):
+            self.flavor_var.set(matches[0])
+            return matches[0]
+        return flavor
 
     def refill_suggestions_cmd(self):
-         suggestions = self.refill_suggestions()
-         suggestions_text = '\n'.join([f'{freezer}: {", ".join(map(str, flavors))}' for freezer, flavors in suggestions.items() if flavors])
-         messagebox.showinfo("Refill Suggestions", suggestions_text or "No refills needed at the moment.")
+         # Reads the usage history (or asks the server) once for both the suggestions
+         # and the days left beside them, on the worker
+         def show(result):
+             suggestions, forecast = result
+
+             def label(freezer, flavor):
+                 # Flavors with recent use show how long they are expected to last
+                 days = forecast.get((freezer, flavor), (0.0, None))[1]
+                 return flavor if days is None else f"{flavor} (~{days:.1f} days)"
+
+             suggestions_text = '\n'.join([f'{freezer}: {", ".join(label(freezer, flavor) for flavor in flavors)}' for freezer, flavors in suggestions.items() if flavors])
+             messagebox.showinfo("Refill Suggestions", suggestions_text or "No refills needed at the moment.")
+
+         def failed(e):
+             if not isinstance(e, (OSError, InventoryError)):
+                 raise e
+             messagebox.showerror("Error", f"Could not work out the refills.\n{e}")
+
+         self.worker.submit(self.store.refill_report, callback=show, errback=failed)
 
     def clear_inventory_cmd(self):
     # Prompt the user to select a freezer to clear
         freezer_to_clear = self.freezer_var.get().strip()
-        if freezer_to_clear not in ['-18', '-12']:
-           messagebox.showerror("Error", "Please enter a valid freezer temperature (-18 or -12) to clear.")
+        if freezer_to_clear not in FREEZERS:
+           messagebox.showerror("Error", f"Please enter a valid freezer temperature ({' or '.join(FREEZERS)}) to clear.")
            return
     # Confirmation dialog
         response = messagebox.askyesno("Confirm", f"Are you sure you want to clear the inventory for freezer {freezer_to_clear}?")
@@ -142,94 +360,139 @@ class InventoryApp(tk.Tk):
     def switch_freezer_cmd(self):
         current_freezer = self.freezer_var.get().strip()
         flavor = self.flavor_var.get().strip()
-        quantity = self.quantity_var.get().strip() # You might need this if you want to switch specific quantities
-    # Determine the new freezer to switch to
-        new_freezer = '-12' if current_freezer == '-18' else '-18'
-    # Check if the current freezer and flavor are valid and exist in the inventory
-        if (current_freezer, flavor) in self.inventory.index:
-            quantity_to_switch = self.inventory.loc[(current_freezer, flavor), 'Quantity']
-            self.inventory.drop((current_freezer, flavor), inplace=True)  # Remove from current freezer
-        # Check if the flavor already exists in the new freezer and update the quantity accordingly
-            if (new_freezer, flavor) in self.inventory.index:
-               self.inventory.loc[(new_freezer, flavor), 'Quantity'] += quantity_to_switch
-            else:
-                new_row = pd.DataFrame({'Quantity': [quantity_to_switch]}, index=pd.MultiIndex.from_tuples([(new_freezer, flavor)], names=['Freezer', 'Flavor']))
-                self.inventory = pd.concat([self.inventory, new_row])
-            save_inventory(self.inventory)
-            self.show_inventory()
+    # Move the whole flavor to the other freezer, merging with any stock already there
+        flavor = self.resolve_flavor(current_freezer, flavor)
+        if flavor is None:
+            return
+
+        def switched(new_freezer):
+            self.changed()
             messagebox.showinfo("Success", f"Switched {flavor} from freezer {current_freezer} to {new_freezer}.")
-        else:
-           messagebox.showerror("Error", f"{flavor} Flavor not found in freezer {current_freezer}.")
+
+        self.run_change(self.store.switch, current_freezer, flavor, done=switched)
     
     def delete_row_cmd(self):
         self.delete_row()
 
-    def clear_inventory(self, freezer):
-    # Load the current inventory
-       inventory_df = load_inventory()
+    def import_movements_cmd(self, kind):
+        path = filedialog.askopenfilename(title='Import Delivery CSV' if kind == 'add' else 'Import Usage CSV',
+                                          filetypes=[('CSV files', '*.csv'), ('All files', '*.*')])
+        if not path:
+            return
+        # Parsing the CSV is the slow part, so the whole import runs on the worker
+        def imported(count):
+            self.changed()
+            messagebox.showinfo("Success", f"Imported {count} {'delivery' if kind == 'add' else 'usage'} rows from {path}.")
+
+        def failed(e):
+            if not isinstance(e, (OSError, InventoryError)):
+                raise e
+            messagebox.showerror("Error", f"Nothing was imported.\n{e}")
+
+        self.worker.submit(self.store.import_movements, path, kind, callback=imported, errback=failed)
+
+    def update_undo_buttons(self):
+        undo_label, redo_label = self.store.undo_log.undo_label(), self.store.undo_log.redo_label()
+        self.undo_button.config(text=f"Undo {undo_label}" if undo_label else 'Undo', state='normal' if undo_label else 'disabled')
+        self.redo_button.config(text=f"Redo {redo_label}" if redo_label else 'Redo', state='normal' if redo_label else 'disabled')
+
+    def undo_cmd(self):
+        self.revert(self.store.undo)
+
+    def redo_cmd(self):
+        self.revert(self.store.redo)
+
+    def revert(self, action):
+        # Undo and redo go through the same change sets as every other edit, so
+        # the table, alerts and saving pick them up on the next poll
+        def reverted(_):
+            self.changed()
+            self.update_undo_buttons()
+
+        self.run_change(action, done=reverted)
+
+    def export_report_cmd(self):
+        report = self.report_var.get()
+        path = filedialog.asksaveasfilename(title=f'Export {report}', initialfile=f'{report}.csv', defaultextension='.csv',
+                                            filetypes=[('CSV files', '*.csv'), ('JSON lines', '*.jsonl')])
+        if not path:
+            return
+        # Only the selected freezer, if one is filled in
+        freezer = self.freezer_var.get().strip()
+        freezer = freezer if freezer in FREEZERS else None
+        if report == 'movements' and self.server is not None:
+            messagebox.showerror("Error", "The usage history is kept by the inventory server. "
+                                          "Export the movements report on the server's computer after stopping it.")
+            return
+
+        def exported(count):
+            messagebox.showinfo("Success", f"Wrote {count} {report} rows to {path}.")
+
+        def failed(e):
+            if not isinstance(e, (OSError, InventoryError)):
+                raise e
+            messagebox.showerror("Error", f"Could not export the report.\n{e}")
+
+        def export():
+            return reports.export(self.store, report, path, freezer=freezer)
 
-    # Identify the rows corresponding to the selected freezer and clear them
-       if freezer in inventory_df.index.get_level_values(0):
-          inventory_df.loc[freezer, 'Flavor'] = ''  # Clear the 'Flavor' column
-          inventory_df.loc[freezer, 'Quantity'] = 0  # Set the 'Quantity' to zero
+        self.export_worker.submit(export, callback=exported, errback=failed)
 
-        # Save the updated inventory
-          save_inventory(inventory_df)
+    def clear_inventory(self, freezer):
+    # Set the quantity of every flavor in the selected freezer to zero
+       def cleared(_):
+          self.changed()
           messagebox.showinfo("Success", f"The inventory for freezer {freezer} has been cleared.")
-       else:
-        messagebox.showerror("Error", f"No inventory found for freezer {freezer}.")
+
+       self.run_change(self.store.clear, freezer, done=cleared, failed=lambda e: messagebox.showerror("Error", f"{e}."))
 
     def add_gelato(self, freezer, flavor, quantity):
-        inventory_df = load_inventory()
-    
-    # Ensure the DataFrame's MultiIndex is lexically sorted
-        inventory_df = inventory_df.sort_index()
-
-        key = (freezer.strip(), flavor.strip())
-        if key in inventory_df.index:
-        # Update the quantity for an existing flavor in the inventory
-           inventory_df.loc[key, 'Quantity'] += quantity
-        else:
-        # Append the new flavor and quantity to the inventory
-           inventory_df = inventory_df._append(pd.DataFrame({'Quantity': [quantity]}, index=pd.MultiIndex.from_tuples([key], names=['Freezer', 'Flavor'])))
-
-        inventory_df.sort_index(inplace=True)
-    # Save the updated inventory to the Excel file
-        save_inventory(inventory_df)
-    
-        messagebox.showinfo("Success", f"Added {quantity} units of {flavor} to freezer {freezer}.")        
+        if not quantity >= 0:
+            messagebox.showerror("Error", "Please enter a valid number for quantity.")
+            return
+        freezer, flavor = freezer.strip(), flavor.strip()
+        # The stock is recorded where the staff say they put it. When that freezer
+        # is short of pan slots they are offered a split, never given one silently.
+        try:
+            placements = self.store.plan_delivery([(flavor, quantity)], preferred={flavor: freezer})
+        except InventoryError as e:
+            messagebox.showerror("Error", str(e))
+            return
+        operations = [('add', freezer, flavor, quantity)]
+        if any(placed_freezer != freezer for placed_freezer, _, _ in placements):
+            placed = ', '.join(f"{amount:g} units in freezer {placed_freezer}" for placed_freezer, _, amount in placements)
+            answer = messagebox.askyesnocancel(
+                "Freezer full", f"Freezer {freezer} is short of pan space. Put {flavor} as {placed} instead?\n"
+                                f"Yes records it that way, No records all of it in freezer {freezer}.")
+            if answer is None:
+                return
+            if answer:
+                operations = [('add', placed_freezer, flavor, amount) for placed_freezer, _, amount in placements]
+
+        def added(_):
+            self.changed()
+            if len(operations) == 1:
+                messagebox.showinfo("Success", f"Added {quantity} units of {flavor} to freezer {freezer}.")
+            else:
+                placed = ', '.join(f"{amount:g} units in freezer {placed_freezer}" for _, placed_freezer, _, amount in operations)
+                messagebox.showinfo("Success", f"Added {flavor}: {placed}.")
+            over = [f"{placed_freezer} ({used}/{slots} pans)" for placed_freezer, (used, slots) in self.store.pan_summary().items()
+                    if used > slots]
+            if over:
+                messagebox.showwarning("Freezer full", f"Over the pan slots: {', '.join(over)}.")
+
+        self.run_change(functools.partial(self.store.apply_batch, operations, label=f"add {flavor}"), done=added)
 
     def use_gelato(self, freezer, flavor, quantity):
-        inventory_df = load_inventory()
-        freezer = freezer.strip()
-        flavor = flavor.strip()
-        key = (freezer, flavor)
+        def used(_):
+            self.changed()
+            messagebox.showinfo("Success", f"Used {quantity} units of {flavor.strip()} from freezer {freezer.strip()}.")
 
-        try:
-            if key in inventory_df.index:
-                current_quantity = inventory_df.loc[key, 'Quantity']
-                if isinstance(current_quantity, pd.Series) and not current_quantity.empty:
-                     current_quantity = current_quantity.iloc[0] 
-
-                new_quantity = max(current_quantity - quantity, 0)
-                inventory_df.loc[key, 'Quantity'] = new_quantity
-                save_inventory(inventory_df)
-                messagebox.showinfo("Success", f"Used {quantity} units of {flavor} from freezer {freezer}.")
-            else:
-                messagebox.showerror("Error", f"{flavor} not found in freezer {freezer}.")
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        self.run_change(self.store.use, freezer, flavor, quantity, done=used,
+                        failed=lambda e: messagebox.showerror("Error", f"{e}."))
 
     def refill_suggestions(self):
-        inventory_df = load_inventory()
-        inventory_df = inventory_df.dropna(subset=['Quantity'])
-        suggestions = (inventory_df[inventory_df['Quantity'] <= REFILL_THRESHOLD]
-                       .reset_index()
-                       .groupby('Freezer')['Flavor']
-                       .apply(list)
-                       .to_dict())
-        
-        return suggestions
+        return self.store.refill_suggestions()
     
     def delete_row(self):
         freezer_temp = self.freezer_var.get().strip()
@@ -242,28 +505,16 @@ class InventoryApp(tk.Tk):
         confirm = messagebox.askyesno("Confirm Delete", f"Are you sure you want to delete all entries from freezer {freezer_temp}?")
         if not confirm:
             return  # User canceled the operation.
-        try:
-        # Check if freezer exists in the inventory
-            if freezer_temp in self.inventory.index.get_level_values(0).unique():
-            # Delete all rows for the specified freezer
-                self.inventory = self.inventory.drop(freezer_temp, level=0)
-                save_inventory(self.inventory)  # Save the updated inventory after modification.
-                self.show_inventory()  # Refresh the displayed inventory.
-                self.clear_text_boxes()  # Clear the input fields, if necessary.
-                messagebox.showinfo("Success", f"All entries from freezer {freezer_temp} have been successfully deleted.")
-            else:
-                messagebox.showerror("Error", f"No entries found for freezer {freezer_temp}.")
-        except Exception as e:
-                messagebox.showerror("Error", f"An error occurred: {str(e)}")
+        def deleted(_):
+            self.changed()
+            self.clear_text_boxes()  # Clear the input fields, if necessary.
+            messagebox.showinfo("Success", f"All entries from freezer {freezer_temp} have been successfully deleted.")
+
+        # Delete all rows for the specified freezer
+        self.run_change(self.store.delete, freezer_temp, done=deleted)
 
     def show_inventory(self):
-       self.freezer_content_text.delete('1.0', tk.END)  # Clear the current contents
-    # Check if there is any inventory to display
-       if not self.inventory.empty:
-           for (freezer, flavor), row in self.inventory.iterrows():
-              self.freezer_content_text.insert(tk.END, f"Freezer: {freezer}, Flavor: {flavor}, Quantity: {row['Quantity']}\n")
-       else:
-          self.freezer_content_text.insert(tk.END, "No inventory found.")
+       self.freezer_table.show(self.store.items(), empty_message="No inventory found.")
 
     def switch_gelato_freezer(self):
         freezer_from = self.freezer_var.get().strip()
@@ -271,34 +522,18 @@ class InventoryApp(tk.Tk):
         if not freezer_from or not flavor_to_switch:
             messagebox.showerror("Error", "Please enter both the freezer and flavor to switch.")
             return
-        if freezer_from not in ['-18', '-12']:
-           messagebox.showerror("Error", "Please enter a valid freezer temperature (-18 or -12).")
+        if freezer_from not in FREEZERS:
+           messagebox.showerror("Error", f"Please enter a valid freezer temperature ({' or '.join(FREEZERS)}).")
            return
-    # Determine the freezer to switch to
-        freezer_to = '-18' if freezer_from == '-12' else '-12'
-        try:
-        # Ensure the item exists in the source freezer
-           if (freezer_from, flavor_to_switch) in self.inventory.index:
-            quantity = self.inventory.loc[(freezer_from, flavor_to_switch), 'Quantity']
+        flavor_to_switch = self.resolve_flavor(freezer_from, flavor_to_switch)
+        if flavor_to_switch is None:
+            return
+        def switched(freezer_to):
+           self.changed()
+           messagebox.showinfo("Success", f"Switched {flavor_to_switch} from freezer {freezer_from} to {freezer_to}.")
 
-            # Update or add the item in the destination freezer
-            if (freezer_to, flavor_to_switch) in self.inventory.index:
-                self.inventory.loc[(freezer_to, flavor_to_switch), 'Quantity'] += quantity
-            else:
-                # Append if not exists
-                new_row = pd.DataFrame({'Quantity': [quantity]}, index=pd.MultiIndex.from_tuples([(freezer_to, flavor_to_switch)], names=['Freezer', 'Flavor']))
-                self.inventory = pd.concat([self.inventory, new_row])
-
-            # Remove the item from the source freezer
-            self.inventory.drop((freezer_from, flavor_to_switch), inplace=True)
-
-            save_inventory(self.inventory)  # Assuming this function correctly saves the inventory to Excel
-            self.show_inventory()
-            messagebox.showinfo("Success", f"Switched {flavor_to_switch} from freezer {freezer_from} to {freezer_to}.")
-           else:
-            messagebox.showerror("Error", f"{flavor_to_switch} Flavor not found in freezer {freezer_from}.")
-        except Exception as e:
-           messagebox.showerror("Error", str(e))
+        # Update or add the item in the destination freezer and remove it from the source freezer
+        self.run_change(self.store.switch, freezer_from, flavor_to_switch, done=switched)
 
     def clear_text_boxes(self):
         self.freezer_var.set('')
@@ -307,16 +542,16 @@ class InventoryApp(tk.Tk):
 
     
     def display_freezer_contents(self, freezer_temp):
-        self.freezer_contents_text.delete('1.0', tk.END)
-        inventory_df = load_inventory()
-        try:
-        # Ensure that the key used to access the inventory matches the index type
-           freezer_inventory = inventory_df.xs(freezer_temp, level='Freezer')
-           for flavor, row in freezer_inventory.iterrows():
-               self.freezer_contents_text.insert(tk.END, f"Flavor: {row['Flavor']}, Quantity: {row['Quantity']}\n")
-        except KeyError as e:
-            self.freezer_contents_text.insert(tk.END, f"Error: {e}\n")
+        self.update_freezer_display(freezer_temp)
 
 if __name__ == "__main__":
+    # manage.py --server HOST:PORT opens the window on a running server.py; any
+    # other arguments run a one-shot command instead of opening the window
+    if len(sys.argv) == 3 and sys.argv[1] == '--server':
+        InventoryApp(server=sys.argv[2]).mainloop()
+        sys.exit()
+    if len(sys.argv) > 1:
+        import cli
+        sys.exit(cli.main())
     app = InventoryApp()
     app.mainloop()
@@ -0,0 +1,106 @@
+import math
+
+# Pan model and allocation. A row of Q units of a flavor occupies
+# ceil(Q / pan_capacity) pans: full pans plus at most one partly used pan.
+# Each freezer has a number of pan slots. The allocator keeps the number of
+# used slots per freezer up to date from the store's change sets, so every add
+# or use costs O(changed rows), and places incoming stock with a best-fit
+# decreasing heuristic. Slots are advisory: nothing stops an add or a set from
+# going over them, so a full freezer shows up in summary() instead of failing.
+
+EPSILON = 1e-9
+
+
+def pans_for(quantity, pan_capacity):
+    if quantity is None or quantity <= EPSILON:
+        return 0
+    return math.ceil(quantity / pan_capacity - EPSILON)
+
+
+class PanAllocator:
+    def __init__(self, slots, pan_capacity):
+        self.slots = dict(slots)  # freezer -> pan slots
+        self.pan_capacity = pan_capacity
+        self.used = {freezer: 0 for freezer in self.slots}
+        self.quantities = {}  # own copy of the rows, to know the old value of a change
+
+    def rebuild(self, quantities):
+        self.quantities = dict(quantities)
+        self.used = {freezer: 0 for freezer in self.slots}
+        for (freezer, _), quantity in self.quantities.items():
+            self.used[freezer] = self.used.get(freezer, 0) + pans_for(quantity, self.pan_capacity)
+
+    def apply_changes(self, changes):
+        # Store listener: only the changed rows are recounted
+        for key, quantity in changes.items():
+            freezer = key[0]
+            old = self.quantities.get(key)
+            self.used[freezer] = self.used.get(freezer, 0) + \
+                pans_for(quantity, self.pan_capacity) - pans_for(old, self.pan_capacity)
+            if quantity is None:
+                self.quantities.pop(key, None)
+            else:
+                self.quantities[key] = quantity
+
+    def free_slots(self, freezer):
+        return self.slots.get(freezer, 0) - self.used.get(freezer, 0)
+
+    def headroom(self, key):
+        # Room left in the partly used pan of a row
+        quantity = self.quantities.get(key) or 0.0
+        return pans_for(quantity, self.pan_capacity) * self.pan_capacity - quantity
+
+    def plan(self, deliveries, preferred=None):
+        # deliveries is a list of (flavor, quantity); preferred optionally maps a
+        # flavor to the freezer it should go to first. Returns a list of
+        # (freezer, flavor, quantity) placements. A flavor with a preferred freezer
+        # fills that one first (topping up only its own part-full pan) and only
+        # spills over once it has no free slots. What no freezer has room for goes
+        # to the first freezer in order, over its slots; a delivery of zero is
+        # placed there too, so the flavor gets a row.
+        preferred = preferred or {}
+        free = {freezer: self.free_slots(freezer) for freezer in self.slots}
+        headroom = {}
+        placements = []
+        # Largest deliveries first, so they get the pick of the space
+        for flavor, quantity in sorted(deliveries, key=lambda item: -item[1]):
+            remaining = quantity
+            first = preferred.get(flavor)
+            order = sorted(self.slots, key=lambda f: (f != first, (f, flavor) not in self.quantities, f))
+            if remaining <= EPSILON:
+                placements.append((order[0], flavor, remaining))
+                continue
+            # Top up partly used pans of the same flavor first; that costs no slots
+            for freezer in [first] if first in self.slots else order:
+                key = (freezer, flavor)
+                room = headroom.get(key, self.headroom(key))
+                amount = min(room, remaining)
+                if amount > EPSILON:
+                    placements.append((freezer, flavor, amount))
+                    headroom[key] = room - amount
+                    remaining -= amount
+            while remaining > EPSILON:
+                needed = pans_for(remaining, self.pan_capacity)
+                # Best fit: the preferred freezer while it has room, else the fullest
+                # freezer that can take the whole lot, else whichever has the most room
+                fits = [f for f in order if free[f] >= needed]
+                if first in self.slots and free[first] > 0:
+                    freezer = first
+                elif fits:
+                    freezer = min(fits, key=lambda f: (free[f], order.index(f)))
+                else:
+                    freezer = max(order, key=lambda f: (free[f], -order.index(f)))
+                    if free[freezer] <= 0:
+                        placements.append((order[0], flavor, remaining))
+                        free[order[0]] -= needed
+                        break
+                pans = min(needed, free[freezer])
+                amount = min(remaining, pans * self.pan_capacity)
+                placements.append((freezer, flavor, amount))
+                free[freezer] -= pans
+                headroom[(freezer, flavor)] = pans * self.pan_capacity - amount
+                remaining -= amount
+        return placements
+
+    def summary(self):
+        return {freezer: (self.used.get(freezer, 0), slots) for freezer, slots in self.slots.items()}
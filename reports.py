@@ -0,0 +1,123 @@
+import csv
+import json
+import os
+import time
+import inventory_store
+from consumption import SECONDS_PER_DAY
+from pans import pans_for
+
+# Streaming reports. Each report is a generator of rows over the store's
+# chunked row iterator or the usage history read from disk in chunks, and the
+# writers consume it row by row, so memory does not grow with the inventory or
+# the history. Files are written next to their destination and swapped in, so
+# a half-written export never replaces a good one.
+#
+#   reports.export(store, 'totals', 'totals.csv')
+#   reports.export(store, 'movements', 'usage.jsonl', days=7)
+
+CHUNK_RECORDS = 1 << 16  # usage records read from disk per chunk
+
+
+def inventory_rows(store, freezer=None):
+    for (f, flavor), quantity in store.iter_rows(freezer):
+        yield f, flavor, quantity, pans_for(quantity, inventory_store.MAX_CAPACITY)
+
+
+def freezer_total_rows(store, freezer=None):
+    totals = {}  # freezer -> [rows, units, pans, low rows]
+    for (f, _), quantity in store.iter_rows(freezer):
+        total = totals.setdefault(f, [0, 0.0, 0, 0])
+        total[0] += 1
+        total[1] += quantity
+        total[2] += pans_for(quantity, inventory_store.MAX_CAPACITY)
+        total[3] += quantity <= inventory_store.REFILL_THRESHOLD
+    slots = store.pan_summary()
+    for f, (rows, units, pans, low) in sorted(totals.items()):
+        yield f, rows, units, pans, slots.get(f, (0, 0))[1], low
+
+
+def low_stock_rows(store, freezer=None):
+    # The refill suggestions, with the forecast behind each one
+    suggestions, forecast = store.refill_report()
+    for f, flavors in suggestions.items():
+        if freezer is not None and f != freezer:
+            continue
+        for flavor in flavors:
+            rate, days = forecast.get((f, flavor), (0.0, None))
+            yield f, flavor, store.get((f, flavor)), round(rate, 3), None if days is None else round(days, 2)
+
+
+def movement_rows(store, freezer=None, days=None):
+    # Units used, number of uses and last use per row, over the last `days`
+    # days or the whole history; totals are folded in one chunk at a time
+    import numpy as np
+
+    history = store.history
+    since = time.time() - days * SECONDS_PER_DAY if days else float('-inf')
+    used = np.zeros(0)
+    uses = np.zeros(0, dtype=np.int64)
+    last = np.zeros(0)
+    for chunk in history.iter_chunks(CHUNK_RECORDS):
+        chunk = chunk[chunk['time'] >= since]
+        if not len(chunk):
+            continue
+        size = max(len(used), int(chunk['key'].max()) + 1)
+        if size > len(used):
+            used, uses, last = (np.concatenate([column, np.zeros(size - len(column), dtype=column.dtype)])
+                                for column in (used, uses, last))
+        used += np.bincount(chunk['key'], weights=chunk['amount'], minlength=size)
+        # An undone use is a negative record and takes its use back off the count
+        uses += np.bincount(chunk['key'], weights=np.sign(chunk['amount']), minlength=size).astype(np.int64)
+        # Records are in time order, so the last write to each index is its latest use
+        last[chunk['key']] = chunk['time']
+    rows = sorted((history.keys[key_id], key_id) for key_id in np.flatnonzero(uses))
+    for (f, flavor), key_id in rows:
+        if freezer is None or f == freezer:
+            yield (f, flavor, round(float(used[key_id]), 3), int(uses[key_id]),
+                   time.strftime('%Y-%m-%d %H:%M', time.localtime(last[key_id])))
+
+
+REPORTS = {
+    'inventory': (('freezer', 'flavor', 'quantity', 'pans'), inventory_rows),
+    'totals': (('freezer', 'rows', 'units', 'pans', 'pan_slots', 'low_rows'), freezer_total_rows),
+    'low-stock': (('freezer', 'flavor', 'quantity', 'use_per_day', 'days_left'), low_stock_rows),
+    'movements': (('freezer', 'flavor', 'used', 'uses', 'last_use'), movement_rows),
+}
+
+
+def write_csv(f, fields, rows):
+    writer = csv.writer(f)
+    writer.writerow(fields)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_jsonl(f, fields, rows):
+    count = 0
+    for row in rows:
+        f.write(json.dumps(dict(zip(fields, row))) + '\n')
+        count += 1
+    return count
+
+
+def export(store, report, path, **options):
+    # Writes a report as CSV, or JSON lines when path ends in .jsonl/.json;
+    # returns the number of rows written
+    try:
+        fields, rows = REPORTS[report]
+    except KeyError:
+        raise inventory_store.InventoryError(f"Unknown report {report!r}; expected one of {', '.join(REPORTS)}")
+    write = write_jsonl if os.path.splitext(path)[1].lower() in ('.jsonl', '.json') else write_csv
+    tmp_file = path + '.tmp'
+    try:
+        with open(tmp_file, 'w', encoding='utf-8', newline='') as f:
+            count = write(f, fields, rows(store, **options))
+        os.replace(tmp_file, path)
+    except BaseException:
+        if os.path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+    return count
@@ -0,0 +1,472 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import socket
+import sqlite3
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+import inventory_store
+from consumption import ConsumptionHistory
+from inventory_store import ConflictError, InventoryError, InventoryStore, lock_data
+from storage import MemoryBackend
+from undo import UndoEntry
+
+# Local inventory server, so several tills can share one inventory without
+# racing on the workbook. The server owns the only InventoryStore; clients
+# send one JSON object per line over TCP and get one JSON object back:
+#
+#   {"op": "use", "freezer": "-18", "flavor": "Pistachio", "quantity": 2}
+#   -> {"ok": true, "result": [["-18", "Pistachio", 3.0]], "version": 41}
+#
+# Mutations run one at a time on a single store thread. Reads are answered on
+# the asyncio loop, but the store holds its lock while a change is written to
+# disk, so a read that arrives mid-write waits for it. Compaction rewrites the
+# workbook on a thread of its own and holds up neither. Reads return row
+# versions; a mutation may carry "expect": [[freezer, flavor, version], ...]
+# and is rejected with "conflict": true if any of those rows has changed since.
+# Versions start from the server's start time, so a client holding versions
+# from before a restart gets a conflict rather than a false match.
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+COMPACT_CHECK_SECONDS = 5
+# A request is one line; a batch or an imported CSV can run to many thousand rows
+MAX_LINE_BYTES = 1 << 28
+
+
+def encode_versions(versions):
+    return [[freezer, flavor, version] for (freezer, flavor), version in versions.items()]
+
+
+def encode_rows(rows):
+    # {key: quantity} -> [[freezer, flavor, quantity]]; decode_rows reverses it
+    return [[freezer, flavor, quantity] for (freezer, flavor), quantity in rows.items()]
+
+
+def encode_forecast(forecast):
+    return [[freezer, flavor, rate, days] for (freezer, flavor), (rate, days) in forecast.items()]
+
+
+def decode_forecast(forecast):
+    return {(freezer, flavor): (rate, days) for freezer, flavor, rate, days in forecast}
+
+
+def decode_rows(rows):
+    return {(freezer, flavor): quantity for freezer, flavor, quantity in rows}
+
+
+class InventoryServer:
+    def __init__(self, store, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.store = store
+        self.host = host
+        self.port = port
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='inventory-store')
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_LINE_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+        asyncio.get_running_loop().create_task(self.compact_periodically())
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def compact_periodically(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(COMPACT_CHECK_SECONDS)
+            if self.store.should_flush():
+                try:
+                    # The snapshot is written in the background; the store thread only parks the journal
+                    await loop.run_in_executor(self.executor, functools.partial(self.store.flush, wait=False))
+                except (OSError, sqlite3.Error) as e:
+                    # Tried again on the next check; the journal still has every change
+                    print(f"Could not compact the inventory: {e}", file=sys.stderr)
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE_BYTES; the rest of it cannot be told from the next request
+                    writer.write(json.dumps({'ok': False, 'error': 'request too large'}).encode() + b'\n')
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    response = await self.dispatch(request)
+                except ConflictError as e:
+                    response = {'ok': False, 'error': str(e), 'conflict': True, 'versions': encode_versions(e.versions)}
+                except (InventoryError, KeyError, TypeError, ValueError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                except (OSError, sqlite3.Error) as e:
+                    # The write failed before the change reached memory, so the client can retry
+                    response = {'ok': False, 'error': f"Could not save the inventory: {e}"}
+                except Exception as e:
+                    # A bug or a malformed request must not cost the till its connection
+                    traceback.print_exc()
+                    response = {'ok': False, 'error': f"The inventory server failed: {e!r}"}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except OSError:
+            pass  # the till went away
+        finally:
+            writer.close()
+
+    async def dispatch(self, request):
+        op = request['op']
+        store = self.store
+        if op == 'items':
+            # Reads come straight from memory on the loop thread
+            rows = [[freezer, flavor, quantity, version]
+                    for (freezer, flavor), quantity, version in store.versioned_items(request.get('freezer'))]
+            return {'ok': True, 'result': rows, 'version': store.version}
+        if op == 'refill':
+            # The forecast the suggestions were ranked by comes along, so a till need not ask again
+            suggestions, forecast = store.refill_report()
+            return {'ok': True, 'result': suggestions, 'forecast': encode_forecast(forecast), 'version': store.version}
+        if op == 'pans':
+            return {'ok': True, 'result': store.pan_summary(), 'version': store.version}
+        if op == 'changes':
+            # Rows changed since a version the client has seen; "reset" asks it to
+            # start over from "items" when that version is from before a restart
+            changed = store.changed_since(request['since'])
+            if changed is None:
+                return {'ok': True, 'result': None, 'reset': True, 'version': store.version}
+            return {'ok': True, 'result': [[freezer, flavor, quantity] for (freezer, flavor), quantity in changed],
+                    'version': store.version}
+        if op == 'forecast':
+            return {'ok': True, 'version': store.version,
+                    'result': encode_forecast(store.forecast())}
+
+        expect = {(freezer, flavor): version for freezer, flavor, version in request.get('expect', [])}
+        if op == 'batch':
+            operations = [tuple(operation) for operation in request['operations']]
+        elif op in ('add', 'use', 'set'):
+            operations = [(op, request['freezer'].strip(), request['flavor'].strip(), float(request['quantity']))]
+        elif op == 'switch':
+            freezer = request['freezer'].strip()
+            to_freezer = request.get('to_freezer') or inventory_store.other_freezer(freezer)
+            operations = [('switch', freezer, request['flavor'].strip(), to_freezer)]
+        elif op in ('clear', 'delete'):
+            operations = [(op, request['freezer'].strip())]
+        elif op == 'receive':
+            preferred = {request['flavor'].strip(): request['freezer']} if request.get('freezer') else None
+            placements, entry = await self.run(self.undoable, store.receive,
+                                               [(request['flavor'], float(request['quantity']))], preferred)
+            return dict(self.describe_entry(entry), ok=True, result=[list(placement) for placement in placements],
+                        version=store.version)
+        elif op == 'revert':
+            # A till's undo or redo; the till keeps the undo log, the server checks the rows
+            await self.run(store.revert, request['label'], decode_rows(request['expected']),
+                           decode_rows(request['target']), decode_rows(request['used']), request['sign'])
+            return {'ok': True, 'result': request['target'], 'version': store.version}
+        else:
+            raise InventoryError(f"unknown op {op!r}")
+        changes, entry = await self.run(self.undoable, store.apply_batch, operations, expect, request.get('label'))
+        return dict(self.describe_entry(entry), ok=True, result=encode_rows(changes), version=store.version)
+
+    def undoable(self, fn, *args):
+        # Runs a mutation on the store thread and returns its result with the undo
+        # entry it recorded, so a till can undo it later; None if nothing changed
+        undo_stack = self.store.undo_log.undo_stack
+        marker = undo_stack[-1] if undo_stack else None
+        result = fn(*args)
+        entry = undo_stack[-1] if undo_stack and undo_stack[-1] is not marker else None
+        return result, entry
+
+    @staticmethod
+    def describe_entry(entry):
+        if entry is None:
+            return {'label': None, 'before': [], 'after': [], 'used': []}
+        return {'label': entry.label, 'before': encode_rows(entry.before), 'after': encode_rows(entry.after),
+                'used': encode_rows(entry.used)}
+
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.executor, fn, *args)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        self.store.close()
+
+
+# Blocking client for the CLI, scripts and the Tk app; one request at a time
+# even when several threads share it. Errors come back as InventoryError, or
+# ConflictError (with .versions) when an expected version was stale. After a
+# lost connection the next request connects again; a request is never resent,
+# since the server may have applied it.
+class InventoryClient:
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=10):
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.sock = self.file = None
+        self._lock = threading.Lock()
+        self._connect()
+
+    def _connect(self):
+        try:
+            self.sock = socket.create_connection((self.host, self.port), timeout=self.timeout)
+        except OSError as e:
+            raise InventoryError(f"Could not reach the inventory server at {self.host}:{self.port}: {e}") from None
+        self.file = self.sock.makefile('rwb')
+
+    def request(self, op, **fields):
+        # The whole response, for ops that send more than a result
+        with self._lock:
+            if self.file is None:
+                self._connect()
+            try:
+                self.file.write(json.dumps(dict(fields, op=op)).encode() + b'\n')
+                self.file.flush()
+                line = self.file.readline()
+            except OSError as e:
+                self._disconnect()
+                raise InventoryError(f"Lost the connection to the inventory server: {e}") from None
+            if not line:
+                self._disconnect()
+                raise InventoryError("The inventory server closed the connection")
+        response = json.loads(line)
+        if not response['ok']:
+            if response.get('conflict'):
+                raise ConflictError(response['error'], {(f, flavor): v for f, flavor, v in response['versions']})
+            raise InventoryError(response['error'])
+        self.version = response['version']
+        return response
+
+    def call(self, op, **fields):
+        return self.request(op, **fields)['result']
+
+    def _disconnect(self):
+        if self.file is not None:
+            try:
+                self.file.close()
+            except OSError:
+                pass  # flushing to a dead connection
+            self.sock.close()
+            self.sock = self.file = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+# Duck-types the parts of InventoryStore that cli.py uses, so any CLI command
+# can be pointed at a running server with --server
+class RemoteStore:
+    def __init__(self, client):
+        self.client = client
+
+    def _quantity(self, changes, freezer, flavor):
+        for f, fl, quantity in changes:
+            if (f, fl) == (freezer.strip(), flavor.strip()):
+                return quantity
+        return self.get((freezer.strip(), flavor.strip()))
+
+    def get(self, key, default=0.0):
+        for (_, flavor), quantity, _ in self.versioned_items(key[0]):
+            if flavor == key[1]:
+                return quantity
+        return default
+
+    def versioned_items(self, freezer=None):
+        rows = self.client.call('items', freezer=freezer)
+        return [((f, flavor), quantity, version) for f, flavor, quantity, version in rows]
+
+    def items(self):
+        return [(key, quantity) for key, quantity, _ in self.versioned_items()]
+
+    def freezer_items(self, freezer):
+        return [(key[1], quantity) for key, quantity, _ in self.versioned_items(freezer)]
+
+    def apply_batch(self, operations, expect=None):
+        changes = self.client.call('batch', operations=[list(operation) for operation in operations],
+                                   expect=encode_versions(expect or {}))
+        return {(freezer, flavor): quantity for freezer, flavor, quantity in changes}
+
+    def add(self, freezer, flavor, quantity):
+        return self._quantity(self.client.call('add', freezer=freezer, flavor=flavor, quantity=quantity), freezer, flavor)
+
+    def use(self, freezer, flavor, quantity):
+        return self._quantity(self.client.call('use', freezer=freezer, flavor=flavor, quantity=quantity), freezer, flavor)
+
+    def switch(self, freezer, flavor, to_freezer=None):
+        to_freezer = to_freezer or inventory_store.other_freezer(freezer.strip())
+        self.client.call('switch', freezer=freezer, flavor=flavor, to_freezer=to_freezer)
+        return to_freezer
+
+    def clear(self, freezer):
+        return len(self.client.call('clear', freezer=freezer))
+
+    def delete(self, freezer):
+        return len(self.client.call('delete', freezer=freezer))
+
+    def receive(self, deliveries, preferred=None):
+        (flavor, quantity), = deliveries
+        freezer = (preferred or {}).get(flavor.strip())
+        return [tuple(placement) for placement in
+                self.client.call('receive', flavor=flavor, quantity=quantity, freezer=freezer)]
+
+    def refill_suggestions(self):
+        return self.client.call('refill')
+
+    def pan_summary(self):
+        return {freezer: tuple(usage) for freezer, usage in self.client.call('pans').items()}
+
+    def import_movements(self, path, kind):
+        # The CSV is parsed here and sent as one batch
+        totals = inventory_store.read_movements_csv(path)
+        self.apply_batch([(kind, freezer, flavor, float(quantity)) for (freezer, flavor), quantity in totals.items()])
+        return len(totals)
+
+    def close(self, compact=False):
+        self.client.close()
+
+
+# Local mirror of the server's inventory for the Tk app. It is a full
+# InventoryStore over an in-memory backend, so the table, alerts, pan counts,
+# autocomplete and undo log work as they do on the files, but every change is
+# made by the server first and only then applied here. poll_server() brings in
+# what other tills changed. The server checks undo and redo against its own
+# rows, so a till never undoes over someone else's edit.
+class MirroredStore(InventoryStore):
+    def __init__(self, client):
+        # Usage is recorded by the server; the mirror never writes a history of its own
+        super().__init__(backend=MemoryBackend(), load=False, history=ConsumptionHistory(os.devnull))
+        self.client = client
+        self.server_version = None
+        self._remote = threading.RLock()  # taken before self._lock, so polls apply in server order
+
+    @classmethod
+    def connect(cls, address):
+        return cls(InventoryClient(*parse_address(address)))
+
+    def reload(self):
+        with self._remote:
+            response = self.client.request('items')
+            self.backend.save_all({(freezer, flavor): quantity for freezer, flavor, quantity, _ in response['result']})
+            super().reload()
+            self.server_version = response['version']
+
+    def poll_server(self):
+        # Applies the rows other tills changed; returns how many
+        with self._remote:
+            if self.server_version is None:
+                return 0  # not loaded yet
+            response = self.client.request('changes', since=self.server_version)
+            if response.get('reset'):
+                # The server restarted; take its rows as they are now
+                rows = {(freezer, flavor): quantity
+                        for freezer, flavor, quantity, _ in self.client.request('items')['result']}
+                rows.update({key: None for key in self.quantities if key not in rows})
+            else:
+                rows = decode_rows(response['result'])
+            changes = {key: quantity for key, quantity in rows.items() if self.quantities.get(key) != quantity}
+            self.apply(changes)
+            self.server_version = self.client.version
+            return len(changes)
+
+    def apply_batch(self, operations, expect=None, label=None):
+        with self._remote:
+            response = self.client.request('batch', operations=[list(operation) for operation in operations],
+                                           expect=encode_versions(expect or {}), label=label)
+            return self._applied(response)
+
+    def receive(self, deliveries, preferred=None):
+        # Placed by the server, which knows every till's pan use; one delivery at a time
+        placements = []
+        with self._remote:
+            for flavor, quantity in deliveries:
+                freezer = (preferred or {}).get(flavor.strip())
+                response = self.client.request('receive', flavor=flavor, quantity=quantity, freezer=freezer)
+                self._applied(response)
+                placements.extend(tuple(placement) for placement in response['result'])
+        return placements
+
+    def _applied(self, response):
+        # Brings the server's change set in here and onto the undo log
+        changes = decode_rows(response['after'])
+        if changes:
+            self.apply(changes)
+            self.undo_log.record(UndoEntry(response['label'], decode_rows(response['before']), changes,
+                                           decode_rows(response['used'])))
+        return changes
+
+    def undo(self):
+        with self._remote:
+            return super().undo()
+
+    def redo(self):
+        with self._remote:
+            return super().redo()
+
+    def revert(self, label, expected, target, used, sign):
+        with self._remote:
+            self.client.call('revert', label=label, expected=encode_rows(expected), target=encode_rows(target),
+                             used=encode_rows(used), sign=sign)
+            self.apply({key: quantity for key, quantity in target.items() if self.quantities.get(key) != quantity})
+
+    def forecast(self):
+        return decode_forecast(self.client.call('forecast'))
+
+    def refill_report(self):
+        response = self.client.request('refill')
+        return response['result'], decode_forecast(response['forecast'])
+
+    def should_flush(self):
+        return False  # the server compacts its own files
+
+    def flush(self, wait=True):
+        pass
+
+    def close(self, compact=True):
+        self.client.close()
+
+
+def parse_address(address):
+    host, _, port = address.rpartition(':')
+    return host or DEFAULT_HOST, int(port)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='server.py', description='Serve the gelato inventory to several tills')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--backend', choices=['partitioned', 'excel', 'sqlite'], default=inventory_store.STORAGE_BACKEND)
+    parser.add_argument('--file', help='workbook or database to use instead of the configured one')
+    args = parser.parse_args(argv)
+    inventory_store.STORAGE_BACKEND = args.backend
+    if args.file:
+        if args.backend == 'sqlite':
+            inventory_store.inventory_db = args.file
+        else:
+            inventory_store.inventory_file = args.file
+    # The server holds the data lock; CLI commands that find it send themselves here
+    address = f"{'127.0.0.1' if args.host in ('', '0.0.0.0', '::') else args.host}:{args.port}"
+    try:
+        store = InventoryStore(lock=lock_data(resident=True, server=address))
+    except InventoryError as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 2
+    server = InventoryServer(store, args.host, args.port)
+    print(f"Serving the inventory on {args.host}:{args.port}", file=sys.stderr)
+    try:
+        asyncio.run(server.serve_forever())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
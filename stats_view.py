@@ -0,0 +1,92 @@
+import tkinter as tk
+from tkinter import filedialog, messagebox, ttk
+import instrumentation
+
+# Stats panel: a window listing every instrumented span (count, mean, p95, max,
+# total) and counter, refreshed once a second while it is open, with switches
+# for recording and for a cProfile capture.
+
+COLUMNS = ('name', 'count', 'mean', 'p95', 'max', 'total')
+HEADINGS = {'name': 'Span', 'count': 'Count', 'mean': 'Mean ms', 'p95': 'p95 ms', 'max': 'Max ms', 'total': 'Total ms'}
+REFRESH_MS = 1000
+
+
+class StatsWindow(tk.Toplevel):
+    def __init__(self, master):
+        super().__init__(master)
+        self.title('Performance Stats')
+        self.geometry('720x420')
+        self.tree = ttk.Treeview(self, columns=COLUMNS, show='headings')
+        for column in COLUMNS:
+            self.tree.heading(column, text=HEADINGS[column])
+            self.tree.column(column, width=260 if column == 'name' else 80, anchor='w' if column == 'name' else 'e')
+        self.tree.grid(row=0, column=0, columnspan=4, sticky='nsew')
+        self.columnconfigure(0, weight=1)
+        self.rowconfigure(0, weight=1)
+
+        self.recording_var = tk.BooleanVar(self, value=instrumentation.enabled)
+        tk.Checkbutton(self, text='Record timings', variable=self.recording_var,
+                       command=self.toggle_recording).grid(row=1, column=0, sticky='w')
+        self.profile_button = tk.Button(self, command=self.toggle_profiling)
+        self.profile_button.grid(row=1, column=1)
+        tk.Button(self, text='Reset', command=self.reset).grid(row=1, column=2)
+        tk.Button(self, text='Write Log', command=self.write_log).grid(row=1, column=3)
+        self.update_profile_button()
+        self._refresh_job = None
+        self.refresh()
+
+    def refresh(self):
+        stats, counters = instrumentation.snapshot()
+        self.tree.delete(*self.tree.get_children())
+        # Most expensive spans first
+        for name, stat in sorted(stats.items(), key=lambda item: -item[1]['total_ms']):
+            self.tree.insert('', 'end', values=(name, stat['count'], f"{stat['mean_ms']:.3f}", f"{stat['p95_ms']:.3f}",
+                                                f"{stat['max_ms']:.3f}", f"{stat['total_ms']:.1f}"))
+        for name, value in sorted(counters.items()):
+            self.tree.insert('', 'end', values=(name, value, '', '', '', ''))
+        self._refresh_job = self.after(REFRESH_MS, self.refresh)
+
+    def destroy(self):
+        # A refresh still scheduled would run against the destroyed tree
+        if self._refresh_job is not None:
+            self.after_cancel(self._refresh_job)
+            self._refresh_job = None
+        super().destroy()
+
+    def toggle_recording(self):
+        if self.recording_var.get():
+            instrumentation.enable()
+        else:
+            instrumentation.disable()
+
+    def update_profile_button(self):
+        self.profile_button.config(text='Stop Profiling' if instrumentation.profiling() else 'Start Profiling')
+
+    def toggle_profiling(self):
+        if not instrumentation.profiling():
+            instrumentation.start_profiling()
+        else:
+            path = filedialog.asksaveasfilename(parent=self, title='Save profile', defaultextension='.prof',
+                                                filetypes=[('cProfile stats', '*.prof')])
+            report = instrumentation.stop_profiling(path or None)
+            self.show_report(report)
+        self.update_profile_button()
+
+    def show_report(self, report):
+        window = tk.Toplevel(self)
+        window.title('Profile')
+        text = tk.Text(window, wrap='none', width=120, height=40)
+        text.insert('1.0', report or 'Nothing was captured.')
+        text.config(state='disabled')
+        text.pack(fill='both', expand=True)
+
+    def reset(self):
+        instrumentation.reset()
+
+    def write_log(self):
+        try:
+            count = instrumentation.write_log()
+        except OSError as e:
+            messagebox.showerror("Error", f"Could not write the stats log: {e}", parent=self)
+            return
+        messagebox.showinfo("Stats", f"Wrote {count} spans to {instrumentation.stats_log}.", parent=self)
@@ -0,0 +1,496 @@
+import hashlib
+import json
+import os
+import sqlite3
+from urllib.parse import quote, unquote
+import instrumentation
+from instrumentation import timed
+
+# Storage backends for the inventory. Every backend hands back and accepts the
+# inventory as a dict of (freezer, flavor) -> quantity; a quantity of None in a
+# change set means the row was deleted. pandas and NumPy are imported inside the
+# functions that use them, so a journal write or an SQLite lookup never pays for them.
+# Workbooks are read and written with openpyxl's streaming modes, row by row.
+
+
+@timed('pandas.frame_from_quantities')
+def frame_from_quantities(quantities):
+    import pandas as pd
+
+    keys = sorted(quantities)
+    index = pd.MultiIndex.from_tuples(keys, names=['Freezer', 'Flavor']) if keys else \
+        pd.MultiIndex.from_arrays([[], []], names=['Freezer', 'Flavor'])
+    return pd.DataFrame({'Quantity': [float(quantities[key]) for key in keys]}, index=index)
+
+
+@timed('pandas.quantities_from_frame')
+def quantities_from_frame(df):
+    # Duplicate rows for the same flavor (one per pan) are folded into a single quantity
+    totals = df.groupby(level=[0, 1])['Quantity'].sum()
+    return {(str(freezer), str(flavor)): float(quantity) for (freezer, flavor), quantity in totals.items()}
+
+
+def apply_changes(quantities, changes):
+    for key, quantity in changes.items():
+        if quantity is None:
+            quantities.pop(key, None)
+        else:
+            quantities[key] = quantity
+
+
+@timed('storage.read_workbook')
+def read_workbook(path):
+    # Sums the Quantity column per (freezer, flavor) from the first two columns.
+    # pandas writes a MultiIndex with each freezer cell merged over its rows, and
+    # merged cells read back empty, so blank index cells take the value above.
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        column = header.index('Quantity') if 'Quantity' in header else 2
+        quantities = {}
+        freezer = flavor = None
+        for row in rows:
+            if len(row) <= column:
+                continue
+            freezer = row[0] if row[0] is not None else freezer
+            flavor = row[1] if row[1] is not None else flavor
+            if freezer is None or flavor is None:
+                continue
+            try:
+                quantity = float(row[column])
+            except (TypeError, ValueError):
+                quantity = 0.0  # blank or text, as pd.to_numeric(errors='coerce').fillna(0) had it
+            if quantity != quantity:
+                quantity = 0.0
+            key = (str(freezer), str(flavor))
+            quantities[key] = quantities.get(key, 0.0) + quantity
+        return quantities
+    finally:
+        workbook.close()
+
+
+@timed('storage.write_workbook')
+def write_workbook(path, quantities):
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet('Sheet1')
+    sheet.append(['Freezer', 'Flavor', 'Quantity'])
+    for (freezer, flavor), quantity in sorted(quantities.items()):
+        sheet.append([freezer, flavor, float(quantity)])
+    workbook.save(path)
+
+
+class StorageBackend:
+    # Whether load_freezers reads only the freezers asked for, so a store can
+    # safely load (and later compact) part of the inventory
+    partitioned = False
+
+    def load(self):
+        raise NotImplementedError
+
+    def load_freezers(self, freezers):
+        freezers = set(freezers)
+        return {key: quantity for key, quantity in self.load().items() if key[0] in freezers}
+
+    def load_freezer(self, freezer):
+        return {flavor: quantity for (_, flavor), quantity in self.load_freezers([freezer]).items()}
+
+    def write(self, changes):
+        raise NotImplementedError
+
+    def save_all(self, quantities):
+        raise NotImplementedError
+
+    # Number of changes written since the last snapshot
+    def pending_changes(self):
+        return 0
+
+    # Backends that keep a log next to their snapshot fold it in here. start_compaction
+    # runs under the store lock and returns False when there is nothing to do;
+    # finish_compaction may then run on a background thread. Partitioned backends
+    # only compact the given freezers (None for all of them).
+    def start_compaction(self, freezers=None):
+        return False
+
+    def finish_compaction(self, quantities):
+        pass
+
+    # Backends kept apart from the main workbook are filled from it once, when
+    # first created; after that an empty one is simply an empty inventory
+    def needs_seed(self):
+        return False
+
+    def mark_seeded(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class MemoryBackend(StorageBackend):
+    # Rows kept in memory only, for a store that mirrors an inventory kept
+    # somewhere else (a till working through the inventory server)
+    def __init__(self, quantities=None):
+        self.quantities = dict(quantities or {})
+
+    def load(self):
+        return dict(self.quantities)
+
+    def write(self, changes):
+        apply_changes(self.quantities, changes)
+
+    def save_all(self, quantities):
+        self.quantities = dict(quantities)
+
+
+def trim_torn_tail(f):
+    # Cuts a last line that never got its newline (a crash mid-append) off a
+    # file opened with 'a+b'; whole lines are left alone
+    end = position = f.seek(0, os.SEEK_END)
+    keep = 0
+    while position > 0:
+        step = min(position, 1 << 12)
+        position -= step
+        f.seek(position)
+        newline = f.read(step).rfind(b'\n')
+        if newline != -1:
+            keep = position + newline + 1
+            break
+    if keep != end:
+        f.truncate(keep)
+
+
+def file_digest(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Columnar NumPy copy of a workbook snapshot. It records the workbook's size,
+# mtime and content hash, and is only trusted while they still match, so a
+# workbook edited by hand in Excel is always re-read.
+class SnapshotCache:
+    def __init__(self, workbook_path):
+        self.workbook_path = workbook_path
+        self.path = os.path.splitext(workbook_path)[0] + '.cache.npz'
+
+    @timed('storage.cache.load')
+    def load(self):
+        import numpy as np
+
+        try:
+            stat = os.stat(self.workbook_path)
+            with np.load(self.path, allow_pickle=False) as cache:
+                columns = {name: cache[name] for name in cache.files}
+        except (OSError, ValueError):
+            instrumentation.count('storage.cache.miss')
+            return None
+        if (int(columns['mtime_ns']), int(columns['size'])) != (stat.st_mtime_ns, stat.st_size):
+            # Touched or copied but possibly unchanged; the hash decides
+            if stat.st_size != int(columns['size']) or file_digest(self.workbook_path) != str(columns['sha1']):
+                instrumentation.count('storage.cache.miss')
+                return None
+            self._write(columns['freezer'], columns['flavor'], columns['quantity'])
+        instrumentation.count('storage.cache.hit')
+        return dict(zip(zip(columns['freezer'].tolist(), columns['flavor'].tolist()), columns['quantity'].tolist()))
+
+    @timed('storage.cache.store')
+    def store(self, quantities):
+        import numpy as np
+
+        keys = list(quantities)
+        self._write(np.array([freezer for freezer, _ in keys], dtype=str),
+                    np.array([flavor for _, flavor in keys], dtype=str),
+                    np.array([quantities[key] for key in keys], dtype=np.float64))
+
+    def _write(self, freezers, flavors, quantities):
+        import numpy as np
+
+        stat = os.stat(self.workbook_path)
+        tmp_file = self.path + '.tmp'
+        with open(tmp_file, 'wb') as f:
+            np.savez(f, freezer=freezers, flavor=flavors, quantity=quantities,
+                     mtime_ns=np.int64(stat.st_mtime_ns), size=np.int64(stat.st_size),
+                     sha1=np.array(file_digest(self.workbook_path)))
+        os.replace(tmp_file, self.path)
+
+    def invalidate(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+# The original workbook format, with an fsync'd journal of changes kept next to it.
+# While a compaction is running the old journal is parked under a second name
+# until the new snapshot is written.
+class ExcelBackend(StorageBackend):
+    def __init__(self, path):
+        self.path = path
+        self.journal_file = os.path.splitext(path)[0] + '.journal'
+        self.compacting_file = self.journal_file + '.compacting'
+        self.cache = SnapshotCache(path)
+
+    def read_snapshot(self):
+        quantities = self.cache.load()
+        if quantities is not None:
+            return quantities
+        try:
+            quantities = read_workbook(self.path)
+        except FileNotFoundError:
+            return {}
+        self.cache.store(quantities)
+        return quantities
+
+    def read_journal(self, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                for line in f:
+                    if not line.endswith('\n'):
+                        break  # torn record from a crash mid-append
+                    try:
+                        freezer, flavor, quantity = json.loads(line)
+                    except ValueError:
+                        break  # torn record from a crash mid-append
+                    yield (freezer, flavor), quantity
+        except FileNotFoundError:
+            return
+
+    @timed('storage.excel.load')
+    def load(self):
+        quantities = self.read_snapshot()
+        # Replay whatever was journaled after the snapshot was taken
+        apply_changes(quantities, dict(self.read_journal(self.compacting_file)))
+        apply_changes(quantities, dict(self.read_journal(self.journal_file)))
+        return quantities
+
+    @timed('storage.excel.write')
+    def write(self, changes):
+        instrumentation.count('storage.rows_written', len(changes))
+        lines = ''.join(json.dumps([freezer, flavor, quantity]) + '\n' for (freezer, flavor), quantity in changes.items())
+        with open(self.journal_file, 'a+b') as f:
+            # Replay stops at a torn record, so anything appended behind one would be lost
+            trim_torn_tail(f)
+            f.write(lines.encode('utf-8'))
+            f.flush()
+            os.fsync(f.fileno())
+
+    @timed('storage.excel.save_all')
+    def save_all(self, quantities):
+        # The new snapshot is the whole inventory, so no journal may be replayed over it
+        self.write_snapshot(quantities)
+        for path in (self.compacting_file, self.journal_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def write_snapshot(self, quantities):
+        # Write next to the real file and swap it in, so a crash mid-save leaves the old snapshot intact
+        tmp_file = os.path.splitext(self.path)[0] + '.tmp.xlsx'
+        write_workbook(tmp_file, quantities)
+        self.cache.invalidate()
+        os.replace(tmp_file, self.path)
+        self.cache.store(quantities)
+
+    def pending_changes(self):
+        count = 0
+        for path in (self.compacting_file, self.journal_file):
+            try:
+                with open(path, 'rb') as f:
+                    count += sum(chunk.count(b'\n') for chunk in iter(lambda: f.read(1 << 16), b''))
+            except FileNotFoundError:
+                pass
+        return count
+
+    def start_compaction(self, freezers=None):
+        has_journal = os.path.exists(self.journal_file)
+        has_parked = os.path.exists(self.compacting_file)
+        if has_journal and has_parked:
+            # A previous compaction failed; keep its records and park the new ones after them
+            with open(self.journal_file, encoding='utf-8') as src, open(self.compacting_file, 'a', encoding='utf-8') as dst:
+                dst.write(src.read())
+            os.remove(self.journal_file)
+        elif has_journal:
+            os.replace(self.journal_file, self.compacting_file)
+        return has_journal or has_parked
+
+    def finish_compaction(self, quantities):
+        # The journal holds what was written since the journal was parked, so it stays
+        self.write_snapshot(quantities)
+        # The snapshot now holds everything in the parked journal
+        if os.path.exists(self.compacting_file):
+            os.remove(self.compacting_file)
+
+
+# One workbook (with its own journal and cache) per freezer, in a folder named
+# after the main workbook: data\Inventory\-18.xlsx and so on. Loading one
+# freezer reads one file, a change is journaled only in the partitions it
+# touches, and compaction rewrites only the partitions that have a journal.
+class PartitionedExcelBackend(StorageBackend):
+    partitioned = True
+    SUFFIXES = ('.xlsx', '.journal', '.journal.compacting')
+
+    def __init__(self, path):
+        self.path = path
+        self.directory = os.path.splitext(path)[0]
+        self.partitions = {}  # freezer -> ExcelBackend
+        self._parked = []  # freezers whose journals the running compaction took
+
+    def partition(self, freezer):
+        backend = self.partitions.get(freezer)
+        if backend is None:
+            backend = ExcelBackend(os.path.join(self.directory, quote(freezer, safe='') + '.xlsx'))
+            self.partitions[freezer] = backend
+        return backend
+
+    def freezers(self):
+        # Every freezer with a workbook or a journal on disk
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return []
+        found = set()
+        for name in names:
+            for suffix in self.SUFFIXES:
+                if name.endswith(suffix) and not name.endswith('.tmp.xlsx'):
+                    found.add(unquote(name[:-len(suffix)]))
+        return sorted(found)
+
+    def needs_seed(self):
+        return not os.path.isdir(self.directory)
+
+    def mark_seeded(self):
+        os.makedirs(self.directory, exist_ok=True)
+
+    def load(self):
+        return self.load_freezers(self.freezers())
+
+    def load_freezers(self, freezers):
+        quantities = {}
+        for freezer in freezers:
+            quantities.update(self.partition(freezer).load())
+        return quantities
+
+    def split(self, quantities):
+        by_freezer = {}
+        for key, quantity in quantities.items():
+            by_freezer.setdefault(key[0], {})[key] = quantity
+        return by_freezer
+
+    def write(self, changes):
+        os.makedirs(self.directory, exist_ok=True)
+        # Partitions that only gain rows go first, so a crash between two
+        # journals (say mid-switch) leaves stock counted twice rather than lost
+        for freezer, part in sorted(self.split(changes).items(), key=lambda item: None in item[1].values()):
+            self.partition(freezer).write(part)
+
+    def save_all(self, quantities):
+        os.makedirs(self.directory, exist_ok=True)
+        by_freezer = self.split(quantities)
+        for freezer in set(self.freezers()) | set(by_freezer):
+            self.partition(freezer).save_all(by_freezer.get(freezer, {}))
+
+    def pending_changes(self):
+        return sum(self.partition(freezer).pending_changes() for freezer in self.freezers())
+
+    def start_compaction(self, freezers=None):
+        candidates = self.freezers() if freezers is None else freezers
+        self._parked = [freezer for freezer in candidates if self.partition(freezer).start_compaction()]
+        return bool(self._parked)
+
+    def finish_compaction(self, quantities):
+        by_freezer = self.split(quantities)
+        for freezer in self._parked:
+            self.partition(freezer).finish_compaction(by_freezer.get(freezer, {}))
+        self._parked = []
+
+
+# SQLite keeps one row per (freezer, flavor) under a primary key, so single-key
+# updates and per-freezer reads are indexed row operations.
+class SqliteBackend(StorageBackend):
+    partitioned = True
+
+    def __init__(self, path):
+        self.path = path
+        # The store may write from a background thread, but only ever one at a time
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS inventory ('
+                          'freezer TEXT NOT NULL, flavor TEXT NOT NULL, quantity REAL NOT NULL, '
+                          'PRIMARY KEY (freezer, flavor)) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)')
+        self.conn.commit()
+
+    def needs_seed(self):
+        # Databases from before the marker count as seeded once they hold rows
+        if self.conn.execute("SELECT 1 FROM meta WHERE key = 'seeded'").fetchone() is not None:
+            return False
+        return self.conn.execute('SELECT 1 FROM inventory LIMIT 1').fetchone() is None
+
+    def mark_seeded(self):
+        with self.conn:
+            self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('seeded', '1')")
+
+    @timed('storage.sqlite.load')
+    def load(self):
+        rows = self.conn.execute('SELECT freezer, flavor, quantity FROM inventory')
+        return {(freezer, flavor): quantity for freezer, flavor, quantity in rows}
+
+    @timed('storage.sqlite.load_freezer')
+    def load_freezer(self, freezer):
+        rows = self.conn.execute('SELECT flavor, quantity FROM inventory WHERE freezer = ?', (freezer,))
+        return dict(rows)
+
+    @timed('storage.sqlite.load_freezers')
+    def load_freezers(self, freezers):
+        freezers = list(freezers)
+        rows = self.conn.execute('SELECT freezer, flavor, quantity FROM inventory WHERE freezer IN '
+                                 f"({', '.join('?' * len(freezers))})", freezers)
+        return {(freezer, flavor): quantity for freezer, flavor, quantity in rows}
+
+    @timed('storage.sqlite.write')
+    def write(self, changes):
+        instrumentation.count('storage.rows_written', len(changes))
+        upserts = [(freezer, flavor, quantity) for (freezer, flavor), quantity in changes.items() if quantity is not None]
+        deletes = [key for key, quantity in changes.items() if quantity is None]
+        with self.conn:
+            if upserts:
+                self.conn.executemany('INSERT INTO inventory (freezer, flavor, quantity) VALUES (?, ?, ?) '
+                                      'ON CONFLICT (freezer, flavor) DO UPDATE SET quantity = excluded.quantity', upserts)
+            if deletes:
+                self.conn.executemany('DELETE FROM inventory WHERE freezer = ? AND flavor = ?', deletes)
+
+    @timed('storage.sqlite.save_all')
+    def save_all(self, quantities):
+        with self.conn:
+            self.conn.execute('DELETE FROM inventory')
+            self.conn.executemany('INSERT INTO inventory (freezer, flavor, quantity) VALUES (?, ?, ?)',
+                                  [(freezer, flavor, quantity) for (freezer, flavor), quantity in quantities.items()])
+
+    def close(self):
+        self.conn.close()
+
+
+BACKENDS = {
+    'excel': ExcelBackend,
+    'partitioned': PartitionedExcelBackend,
+    'sqlite': SqliteBackend,
+}
+
+
+def open_backend(name, path, excel_path=None):
+    try:
+        backend = BACKENDS[name](path)
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {name!r}; expected one of {', '.join(BACKENDS)}")
+    # A new database or partition folder starts from the existing workbook, if
+    # there is one; only the once, so emptying the inventory later sticks
+    if excel_path and backend.needs_seed():
+        if os.path.exists(excel_path):
+            backend.save_all(ExcelBackend(excel_path).load())
+        backend.mark_seeded()
+    return backend
@@ -0,0 +1,483 @@
+import bisect
+import json
+import os
+import sqlite3
+import sys
+import time
+from filelock import FileLock
+
+# Offline sync between shops. Every shop keeps a change log: each change set
+# the store writes is appended with the next sequence number, in segment files
+# of SEGMENT_SETS sets, so reading "everything after seq N" opens only the
+# segments that can hold it. A shop ships a bundle to head office, either as a
+# file or over a socket, holding the net value of every row changed since the
+# last sequence number head office has. The first bundle from a log is a
+# snapshot of the whole inventory instead, and so is any bundle that would
+# need change sets already pruned from the log.
+#
+# Several processes may append to one log (the shop app, the CLI, the
+# server): sequence numbers are handed out under a lock on the log directory,
+# after reading what the others appended. Segments whose sets head office has
+# confirmed (push) or that were shipped before the latest export are deleted.
+#
+# Head office merges bundles into a consolidated SQLite view with rows keyed by
+# (store, freezer, flavor). Conflicts are resolved deterministically:
+#   - each store's change sets are applied in sequence order, exactly once;
+#     replays are ignored and bundles that skip ahead are held back until the
+#     gap is filled, so arrival order never changes the result
+#   - bundles carry absolute quantities, so a bundle overlapping one already
+#     merged still ends in the same state
+#   - if a store's log is replaced (reinstall, restored backup), the snapshot
+#     of the newest log wins: logs are ordered by (created, log id)
+#   - stores never write each other's rows; totals are summed across stores
+#
+#   python sync.py export shop.sync.gz           (at the shop)
+#   python sync.py merge consolidated.db shop.sync.gz
+#   python sync.py serve consolidated.db         (or, with head office online)
+#   python sync.py push 192.168.1.10:8766
+
+SEGMENT_SETS = 1000  # change sets per log segment
+DEFAULT_PORT = 8766
+# A bundle travels as one line, and a first push is the whole inventory
+MAX_LINE_BYTES = 1 << 28
+
+
+class ChangeLog:
+    def __init__(self, directory, store_id=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.lock_path = os.path.join(directory, 'log.lock')
+        meta_path = os.path.join(directory, 'log.json')
+        try:
+            with open(meta_path, encoding='utf-8') as f:
+                meta = json.load(f)
+        except FileNotFoundError:
+            import socket
+            import uuid
+
+            meta = {'store': store_id or socket.gethostname(), 'log': uuid.uuid4().hex, 'created': time.time()}
+            write_json(meta_path, meta)
+        self.store_id, self.log_id, self.created = meta['store'], meta['log'], meta['created']
+        self.segments = []
+        self.last_seq = 0
+        self._size = 0  # bytes of the last segment read so far
+        self._catch_up()
+
+    def segment_path(self, first):
+        return os.path.join(self.directory, f"{first:012d}.jsonl")
+
+    def read_segment(self, first, offset=0):
+        # Yields (change set, offset just past it) from offset on. Stops at a
+        # line without its newline: a torn record from a crash, or one still being
+        # written by another process. A segment pruned meanwhile reads as empty.
+        try:
+            f = open(self.segment_path(first), 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            f.seek(offset)
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    change_set = json.loads(line)
+                except ValueError:
+                    break
+                offset += len(line)
+                yield change_set, offset
+
+    def _catch_up(self):
+        # Picks up segments and change sets other processes added or pruned.
+        # Segments are named after the first sequence number they hold.
+        segments = sorted(int(name[:-len('.jsonl')]) for name in os.listdir(self.directory) if name.endswith('.jsonl'))
+        if not segments:
+            return
+        if not self.segments or segments[-1] != self.segments[-1]:
+            self._size = 0
+        self.segments = segments
+        for change_set, end in self.read_segment(segments[-1], self._size):
+            self.last_seq, self._size = change_set['seq'], end
+        self.last_seq = max(self.last_seq, segments[-1] - 1)
+
+    def refresh(self):
+        with FileLock(self.lock_path):
+            self._catch_up()
+
+    def append(self, changes):
+        # Called by the store right after each backend write
+        with FileLock(self.lock_path):
+            self._catch_up()
+            seq = self.last_seq + 1
+            if not self.segments or seq - self.segments[-1] >= SEGMENT_SETS:
+                self.segments.append(seq)
+                self._size = 0
+            line = json.dumps({'seq': seq, 'time': time.time(),
+                               'changes': [[freezer, flavor, quantity] for (freezer, flavor), quantity in changes.items()]})
+            data = (line + '\n').encode('utf-8')
+            with open(self.segment_path(self.segments[-1]), 'ab') as f:
+                # Drop a torn tail first, or the new set would land behind it
+                f.truncate(self._size)
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            self.last_seq = seq
+            self._size += len(data)
+            return seq
+
+    def since(self, seq):
+        # Change sets after seq, oldest first
+        start = max(bisect.bisect_right(self.segments, seq + 1) - 1, 0)
+        for first in self.segments[start:]:
+            for change_set, _ in self.read_segment(first):
+                if change_set['seq'] > seq:
+                    yield change_set
+
+    def first_seq(self):
+        # Oldest sequence number still in the log
+        return self.segments[0] if self.segments else self.last_seq + 1
+
+    def prune(self, seq):
+        # Deletes the segments holding nothing after seq; the last one is always
+        # kept, since it is where the next set goes. Returns how many were deleted.
+        with FileLock(self.lock_path):
+            self._catch_up()
+            keep = max(bisect.bisect_right(self.segments, seq + 1) - 1, 0)
+            for first in self.segments[:keep]:
+                try:
+                    os.remove(self.segment_path(first))
+                except FileNotFoundError:
+                    pass
+            del self.segments[:keep]
+            return keep
+
+    def shipped(self):
+        # Last sequence number exported to a file, or None before the first export
+        try:
+            with open(os.path.join(self.directory, 'shipped.json'), encoding='utf-8') as f:
+                return json.load(f)['seq']
+        except FileNotFoundError:
+            return None
+
+    def mark_shipped(self, seq):
+        write_json(os.path.join(self.directory, 'shipped.json'), {'seq': seq})
+
+
+def write_json(path, value):
+    tmp_file = path + '.tmp'
+    with open(tmp_file, 'w', encoding='utf-8') as f:
+        json.dump(value, f)
+    os.replace(tmp_file, path)
+
+
+def make_bundle(log, since, snapshot):
+    # since is the last sequence number the receiver has from this log, or None
+    # if it has nothing from it; snapshot() returns the current quantities.
+    # Returns None when the receiver is already up to date.
+    header = {'store': log.store_id, 'log': log.log_id, 'created': log.created}
+    log.refresh()
+    if since is not None and since + 1 < log.first_seq():
+        since = None  # the sets it is missing have been pruned
+    if since is None:
+        # Read the position first: the snapshot is at least this recent, and
+        # re-applying later sets over it is harmless
+        seq = log.last_seq
+        rows = snapshot()
+        return dict(header, snapshot=True, seq=seq,
+                    changes=[[freezer, flavor, quantity] for (freezer, flavor), quantity in sorted(rows.items())])
+    net = {}
+    last = None
+    for change_set in log.since(since):
+        for freezer, flavor, quantity in change_set['changes']:
+            net[(freezer, flavor)] = quantity
+        last = change_set['seq']
+    if last is None:
+        return None
+    return dict(header, seq=last, changes=[[freezer, flavor, quantity] for (freezer, flavor), quantity in net.items()],
+                **{'from': since + 1})
+
+
+def write_bundle(path, bundle):
+    import gzip
+
+    tmp_file = path + '.tmp'
+    with gzip.open(tmp_file, 'wt', encoding='utf-8') as f:
+        json.dump(bundle, f)
+    os.replace(tmp_file, path)
+
+
+def read_bundle(path):
+    import gzip
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        return json.load(f)
+
+
+# Head office's view of every shop. Merging costs one indexed upsert per row
+# in the bundle, whatever the size of the consolidated inventory.
+class ConsolidatedView:
+    def __init__(self, path):
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS stock ('
+                          'store TEXT NOT NULL, freezer TEXT NOT NULL, flavor TEXT NOT NULL, quantity REAL NOT NULL, '
+                          'PRIMARY KEY (store, freezer, flavor)) WITHOUT ROWID')
+        self.conn.execute('CREATE TABLE IF NOT EXISTS peers ('
+                          'store TEXT PRIMARY KEY, log TEXT NOT NULL, created REAL NOT NULL, seq INTEGER NOT NULL)')
+        # Bundles that arrived ahead of a gap, or before their log's snapshot
+        self.conn.execute('CREATE TABLE IF NOT EXISTS held ('
+                          'store TEXT NOT NULL, log TEXT NOT NULL, from_seq INTEGER NOT NULL, seq INTEGER NOT NULL, '
+                          'bundle TEXT NOT NULL, PRIMARY KEY (store, log, from_seq, seq))')
+        self.conn.commit()
+
+    def position(self, store):
+        # (log id, last merged seq) for a store, or None if it never synced
+        row = self.conn.execute('SELECT log, seq FROM peers WHERE store = ?', (store,)).fetchone()
+        return tuple(row) if row else None
+
+    def merge(self, bundle):
+        # Returns 'applied', 'duplicate', 'held' or 'stale'
+        with self.conn:
+            status = self._merge(bundle)
+            if status == 'applied':
+                self._release_held(bundle['store'])
+        return status
+
+    def _merge(self, bundle):
+        store = bundle['store']
+        peer = self.conn.execute('SELECT log, created, seq FROM peers WHERE store = ?', (store,)).fetchone()
+        same_log = peer is not None and peer[0] == bundle['log']
+        if peer is not None and not same_log and (peer[1], peer[0]) > (bundle['created'], bundle['log']):
+            return 'stale'  # from a log that has since been replaced
+        if bundle.get('snapshot'):
+            if same_log and bundle['seq'] <= peer[2]:
+                return 'duplicate'
+            self.conn.execute('DELETE FROM stock WHERE store = ?', (store,))
+            self.conn.executemany('INSERT INTO stock (store, freezer, flavor, quantity) VALUES (?, ?, ?, ?)',
+                                  [(store, freezer, flavor, quantity) for freezer, flavor, quantity in bundle['changes']
+                                   if quantity is not None])
+        else:
+            if not same_log or bundle['from'] > peer[2] + 1:
+                self.conn.execute('INSERT OR IGNORE INTO held (store, log, from_seq, seq, bundle) VALUES (?, ?, ?, ?, ?)',
+                                  (store, bundle['log'], bundle['from'], bundle['seq'], json.dumps(bundle)))
+                return 'held'
+            if bundle['seq'] <= peer[2]:
+                return 'duplicate'
+            upserts = [(store, freezer, flavor, quantity) for freezer, flavor, quantity in bundle['changes']
+                       if quantity is not None]
+            deletes = [(store, freezer, flavor) for freezer, flavor, quantity in bundle['changes'] if quantity is None]
+            self.conn.executemany('INSERT INTO stock (store, freezer, flavor, quantity) VALUES (?, ?, ?, ?) '
+                                  'ON CONFLICT (store, freezer, flavor) DO UPDATE SET quantity = excluded.quantity',
+                                  upserts)
+            self.conn.executemany('DELETE FROM stock WHERE store = ? AND freezer = ? AND flavor = ?', deletes)
+        self.conn.execute('INSERT INTO peers (store, log, created, seq) VALUES (?, ?, ?, ?) ON CONFLICT (store) '
+                          'DO UPDATE SET log = excluded.log, created = excluded.created, seq = excluded.seq',
+                          (store, bundle['log'], bundle['created'], bundle['seq']))
+        return 'applied'
+
+    def _release_held(self, store):
+        # Retry held bundles until none of them applies any more
+        while True:
+            held = self.conn.execute('SELECT log, from_seq, seq, bundle FROM held WHERE store = ? ORDER BY from_seq',
+                                     (store,)).fetchall()
+            progress = False
+            for log, from_seq, seq, bundle in held:
+                status = self._merge(json.loads(bundle))
+                if status != 'held':
+                    self.conn.execute('DELETE FROM held WHERE store = ? AND log = ? AND from_seq = ? AND seq = ?',
+                                      (store, log, from_seq, seq))
+                    progress = progress or status == 'applied'
+            if not progress:
+                return
+
+    def rows(self, store=None):
+        if store is None:
+            return self.conn.execute('SELECT store, freezer, flavor, quantity FROM stock ORDER BY store, freezer, flavor')
+        return self.conn.execute('SELECT store, freezer, flavor, quantity FROM stock WHERE store = ? '
+                                 'ORDER BY freezer, flavor', (store,))
+
+    def totals(self):
+        # (freezer, flavor, total quantity, number of stores) across every shop
+        return self.conn.execute('SELECT freezer, flavor, SUM(quantity), COUNT(*) FROM stock '
+                                 'GROUP BY freezer, flavor ORDER BY freezer, flavor')
+
+    def close(self):
+        self.conn.close()
+
+
+class SyncServer:
+    # Head office end of `push`, one JSON object per line as in server.py:
+    #   {"op": "position", "store": "centro"} -> {"ok": true, "log": ..., "seq": 41}
+    #   {"op": "merge", "bundle": {...}}      -> {"ok": true, "status": "applied", "log": ..., "seq": 42}
+    # A merge answers with the position afterwards, which the shop may prune up to.
+    def __init__(self, view, host='0.0.0.0', port=DEFAULT_PORT):
+        self.view = view
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        import asyncio
+
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port, limit=MAX_LINE_BYTES)
+        self.port = self.server.sockets[0].getsockname()[1]
+
+    async def serve_forever(self):
+        await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    async def handle_client(self, reader, writer):
+        try:
+            while True:
+                try:
+                    line = await reader.readline()
+                except ValueError:
+                    # Longer than MAX_LINE_BYTES; the rest of it cannot be told from the next request
+                    writer.write(json.dumps({'ok': False, 'error': 'request too large'}).encode() + b'\n')
+                    await writer.drain()
+                    break
+                if not line:
+                    break
+                try:
+                    request = json.loads(line)
+                    if request['op'] == 'position':
+                        position = self.view.position(request['store'])
+                        response = {'ok': True, 'log': position and position[0], 'seq': position and position[1]}
+                    elif request['op'] == 'merge':
+                        status = self.view.merge(request['bundle'])
+                        position = self.view.position(request['bundle']['store'])
+                        response = {'ok': True, 'status': status, 'log': position and position[0],
+                                    'seq': position and position[1]}
+                    else:
+                        response = {'ok': False, 'error': f"unknown op {request['op']!r}"}
+                except (KeyError, TypeError, ValueError) as e:
+                    response = {'ok': False, 'error': str(e)}
+                writer.write(json.dumps(response).encode() + b'\n')
+                await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+
+def call(file, request):
+    file.write(json.dumps(request).encode() + b'\n')
+    file.flush()
+    response = json.loads(file.readline() or b'{"ok": false, "error": "connection closed"}')
+    if not response['ok']:
+        raise ConnectionError(response['error'])
+    return response
+
+
+def push(log, snapshot, host, port=DEFAULT_PORT):
+    # Sends head office whatever it is missing from this shop; returns the
+    # merge status, or None if it was already up to date. Segments head office
+    # has confirmed are pruned.
+    import socket
+
+    with socket.create_connection((host, port), timeout=30) as sock, sock.makefile('rwb') as f:
+        position = call(f, {'op': 'position', 'store': log.store_id})
+        since = position['seq'] if position['log'] == log.log_id else None
+        bundle = make_bundle(log, since, snapshot)
+        if bundle is not None:
+            position = call(f, {'op': 'merge', 'bundle': bundle})
+        if position['log'] == log.log_id:
+            log.prune(position['seq'])
+        return position['status'] if bundle is not None else None
+
+
+def main(argv=None):
+    import argparse
+    import inventory_store
+    from inventory_store import open_change_log, open_storage
+
+    parser = argparse.ArgumentParser(prog='sync.py', description='Sync shop inventories into one consolidated view')
+    parser.add_argument('--backend', choices=['partitioned', 'excel', 'sqlite'], help='storage backend (default: %(default)s)',
+                        default=inventory_store.STORAGE_BACKEND)
+    parser.add_argument('--file', help='workbook or database to use instead of the configured one')
+    commands = parser.add_subparsers(dest='command', required=True)
+    export = commands.add_parser('export', help='write the changes since the last export to a bundle file')
+    export.add_argument('path')
+    export.add_argument('--since', type=int, help='sequence number the receiver already has')
+    export.add_argument('--full', action='store_true', help='send a snapshot of the whole inventory')
+    merge = commands.add_parser('merge', help='merge bundle files into a consolidated database')
+    merge.add_argument('database')
+    merge.add_argument('bundles', nargs='+')
+    serve = commands.add_parser('serve', help='accept pushes from shops')
+    serve.add_argument('database')
+    serve.add_argument('--host', default='0.0.0.0')
+    serve.add_argument('--port', type=int, default=DEFAULT_PORT)
+    push_cmd = commands.add_parser('push', help='send the changes head office is missing')
+    push_cmd.add_argument('address', metavar='HOST[:PORT]')
+    show = commands.add_parser('show', help='print the consolidated inventory')
+    show.add_argument('database')
+    show.add_argument('--by-store', action='store_true')
+    args = parser.parse_args(argv)
+    inventory_store.STORAGE_BACKEND = args.backend
+    if args.file:
+        if args.backend == 'sqlite':
+            inventory_store.inventory_db = args.file
+        else:
+            inventory_store.inventory_file = args.file
+
+    def snapshot():
+        backend = open_storage()
+        try:
+            return backend.load()
+        finally:
+            backend.close()
+
+    if args.command == 'export':
+        log = open_change_log()
+        since = None if args.full else args.since if args.since is not None else log.shipped()
+        bundle = make_bundle(log, since, snapshot)
+        if bundle is None:
+            print("Nothing has changed since the last export.")
+            return 0
+        write_bundle(args.path, bundle)
+        shipped = log.shipped()
+        log.mark_shipped(bundle['seq'])
+        # One bundle's worth is kept, so a lost file can be sent again with --since
+        if shipped is not None:
+            log.prune(shipped)
+        kind = 'snapshot' if bundle.get('snapshot') else f"changes {bundle['from']}-{bundle['seq']}"
+        print(f"Wrote {len(bundle['changes'])} rows ({kind}) from {log.store_id} to {args.path}.")
+    elif args.command == 'merge':
+        view = ConsolidatedView(args.database)
+        try:
+            for path in args.bundles:
+                bundle = read_bundle(path)
+                print(f"{path}: {view.merge(bundle)} ({bundle['store']}, up to change {bundle['seq']})")
+        finally:
+            view.close()
+    elif args.command == 'serve':
+        view = ConsolidatedView(args.database)
+        print(f"Accepting shop pushes on {args.host}:{args.port}", file=sys.stderr)
+        import asyncio
+
+        try:
+            asyncio.run(SyncServer(view, args.host, args.port).serve_forever())
+        except KeyboardInterrupt:
+            pass
+        finally:
+            view.close()
+    elif args.command == 'push':
+        host, _, port = args.address.partition(':')
+        status = push(open_change_log(), snapshot, host, int(port) if port else DEFAULT_PORT)
+        print("Head office is up to date." if status is None else f"Pushed: {status}")
+    elif args.command == 'show':
+        view = ConsolidatedView(args.database)
+        try:
+            if args.by_store:
+                for store, freezer, flavor, quantity in view.rows():
+                    print(f"{store}\t{freezer}\t{flavor}\t{quantity}")
+            else:
+                for freezer, flavor, quantity, stores in view.totals():
+                    print(f"{freezer}\t{flavor}\t{quantity}\t({stores} store{'s' if stores != 1 else ''})")
+        finally:
+            view.close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
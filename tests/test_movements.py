@@ -0,0 +1,22 @@
+import pytest
+from inventory_store import InventoryError, read_movements_csv
+
+
+def test_sums_repeated_rows(tmp_path):
+    path = tmp_path / 'delivery.csv'
+    path.write_text('Freezer,Flavor,Quantity\n-18, Pistachio ,2\n-18,Pistachio,1.5\n-20,Lemon,1\n')
+    totals = read_movements_csv(str(path))
+    assert totals[('-18', 'Pistachio')] == 3.5
+    assert totals[('-20', 'Lemon')] == 1
+
+
+@pytest.mark.parametrize('content', [
+    b'',  # EmptyDataError
+    b'Freezer,Flavor,Quantity\n-18,Pistachio,2\n-18,"Lemon,1,2,3\n',  # ParserError
+    b'Freezer,Flavor,Quantity\n-18,Stracciatella \xff\xfe,2\n',  # UnicodeDecodeError
+])
+def test_unreadable_file_is_an_inventory_error(tmp_path, content):
+    path = tmp_path / 'delivery.csv'
+    path.write_bytes(content)
+    with pytest.raises(InventoryError):
+        read_movements_csv(str(path))
@@ -0,0 +1,42 @@
+from pans import PanAllocator
+
+SLOTS = {'-18': 4, '-12': 2}
+
+
+def allocator(quantities):
+    pans = PanAllocator(SLOTS, 10)
+    pans.rebuild(quantities)
+    return pans
+
+
+def test_preferred_freezer_first_even_with_a_part_full_pan_elsewhere():
+    pans = allocator({('-12', 'Pistachio'): 3.0})
+    assert pans.plan([('Pistachio', 5)], {'Pistachio': '-18'}) == [('-18', 'Pistachio', 5)]
+
+
+def test_tops_up_the_preferred_freezer_pan():
+    pans = allocator({('-18', 'Pistachio'): 3.0})
+    assert pans.plan([('Pistachio', 12)], {'Pistachio': '-18'}) == [('-18', 'Pistachio', 7.0), ('-18', 'Pistachio', 5.0)]
+
+
+def test_spills_only_once_the_preferred_freezer_is_full():
+    pans = allocator({('-12', 'Fior di latte'): 10.0})
+    assert pans.plan([('Pistachio', 55)], {'Pistachio': '-18'}) == [('-18', 'Pistachio', 40), ('-12', 'Pistachio', 10)] + \
+        [('-18', 'Pistachio', 5)]
+
+
+def test_without_a_preference_tops_up_anywhere():
+    pans = allocator({('-12', 'Pistachio'): 3.0})
+    assert pans.plan([('Pistachio', 5)]) == [('-12', 'Pistachio', 5)]
+
+
+def test_zero_delivery_gets_a_row():
+    pans = allocator({})
+    assert pans.plan([('Pistachio', 0)], {'Pistachio': '-18'}) == [('-18', 'Pistachio', 0)]
+
+
+def test_over_capacity_is_advisory():
+    pans = allocator({('-18', 'Stracciatella'): 40.0, ('-12', 'Fior di latte'): 20.0})
+    assert pans.plan([('Pistachio', 5)], {'Pistachio': '-12'}) == [('-12', 'Pistachio', 5)]
+    pans.apply_changes({('-12', 'Pistachio'): 5.0})
+    assert pans.summary() == {'-18': (4, 4), '-12': (3, 2)}
@@ -0,0 +1,64 @@
+import asyncio
+import threading
+import pytest
+from consumption import ConsumptionHistory
+from inventory_store import InventoryError, InventoryStore
+from server import InventoryClient, InventoryServer, MirroredStore, RemoteStore
+from storage import SqliteBackend
+
+
+@pytest.fixture
+def server(tmp_path):
+    store = InventoryStore(backend=SqliteBackend(str(tmp_path / 'inventory.db')),
+                           history=ConsumptionHistory(str(tmp_path / 'inventory.usage')))
+    server = InventoryServer(store, '127.0.0.1', 0)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    yield server
+
+    async def shut_down():
+        server.server.close()
+        await server.server.wait_closed()
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    asyncio.run_coroutine_threadsafe(shut_down(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+    server.close()
+
+
+def test_batch_over_64_kib(server):
+    remote = RemoteStore(InventoryClient('127.0.0.1', server.port))
+    operations = [('add', '-18', f"Flavor {n:05d}", 1.0) for n in range(5000)]
+    assert len(remote.apply_batch(operations)) == 5000
+    assert server.store.get(('-18', 'Flavor 04999')) == 1.0
+    remote.close()
+
+
+def test_bad_request_keeps_the_connection(server):
+    client = InventoryClient('127.0.0.1', server.port)
+    with pytest.raises(InventoryError):
+        client.call('batch', operations=[['add', '-18']])
+    with pytest.raises(InventoryError):
+        client.call('batch', operations=5)
+    assert client.call('items') == []
+    client.close()
+
+
+def test_refill_report_in_one_request(server):
+    server.store.apply_batch([('add', '-18', 'Pistachio', 5.0), ('add', '-18', 'Lemon', 1.0)])
+    server.store.use('-18', 'Pistachio', 4.0)
+    mirror = MirroredStore(InventoryClient('127.0.0.1', server.port))
+    mirror.reload()
+    requests = []
+    request = mirror.client.request
+    mirror.client.request = lambda op, **fields: requests.append(op) or request(op, **fields)
+    suggestions, forecast = mirror.refill_report()
+    assert requests == ['refill']
+    assert (suggestions, forecast) == server.store.refill_report()
+    assert forecast[('-18', 'Pistachio')][0] > 0
+    mirror.close()
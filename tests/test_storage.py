@@ -0,0 +1,40 @@
+from storage import ExcelBackend, PartitionedExcelBackend, open_backend
+
+
+def test_append_after_a_torn_journal_record(tmp_path):
+    backend = ExcelBackend(str(tmp_path / 'Inventory.xlsx'))
+    backend.write({('-18', 'Amarena'): 1.0})
+    with open(backend.journal_file, 'ab') as f:
+        f.write(b'["-18", "Bacio", 2')  # the process died mid-append
+    backend.write({('-18', 'Cassata'): 3.0})
+    backend.write({('-18', 'Dulce'): 4.0})
+    assert backend.load() == {('-18', 'Amarena'): 1.0, ('-18', 'Cassata'): 3.0, ('-18', 'Dulce'): 4.0}
+
+
+def test_save_all_drops_the_journals(tmp_path):
+    backend = ExcelBackend(str(tmp_path / 'Inventory.xlsx'))
+    backend.write({('-18', 'Amarena'): 5.0})
+    backend.start_compaction()
+    backend.write({('-18', 'Amarena'): 6.0})
+    backend.save_all({('-18', 'Amarena'): 99.0})
+    assert ExcelBackend(backend.path).load() == {('-18', 'Amarena'): 99.0}
+
+
+def test_partitioned_save_all_drops_the_journals(tmp_path):
+    backend = PartitionedExcelBackend(str(tmp_path / 'Inventory.xlsx'))
+    backend.write({('-18', 'Amarena'): 5.0, ('-12', 'Bacio'): 1.0})
+    backend.save_all({('-18', 'Amarena'): 99.0})
+    assert PartitionedExcelBackend(backend.path).load() == {('-18', 'Amarena'): 99.0}
+
+
+def test_emptied_database_is_not_seeded_again(tmp_path):
+    workbook = ExcelBackend(str(tmp_path / 'Inventory.xlsx'))
+    workbook.save_all({('-18', 'Amarena'): 5.0})
+    path = str(tmp_path / 'Inventory.db')
+    backend = open_backend('sqlite', path, excel_path=workbook.path)
+    assert backend.load() == {('-18', 'Amarena'): 5.0}
+    backend.write({('-18', 'Amarena'): None})
+    backend.close()
+    backend = open_backend('sqlite', path, excel_path=workbook.path)
+    assert backend.load() == {}
+    backend.close()
@@ -0,0 +1,93 @@
+import asyncio
+import threading
+import sync
+from sync import ChangeLog, ConsolidatedView, make_bundle
+
+
+def changes(log, *values):
+    # Appends one change set per value, all to the same row, and returns the rows
+    rows = {}
+    for value in values:
+        rows[('-18', 'Pistachio')] = value
+        log.append({('-18', 'Pistachio'): value})
+    return rows
+
+
+def test_bundles_out_of_order_and_twice(tmp_path):
+    log = ChangeLog(str(tmp_path / 'log'), 'centro')
+    rows = changes(log, 1.0)
+    first = make_bundle(log, None, lambda: dict(rows))
+    rows = changes(log, 2.0, 3.0)
+    second = make_bundle(log, first['seq'], lambda: dict(rows))
+    rows = changes(log, 4.0)
+    third = make_bundle(log, second['seq'], lambda: dict(rows))
+
+    view = ConsolidatedView(str(tmp_path / 'consolidated.db'))
+    assert view.merge(third) == 'held'
+    assert view.merge(second) == 'held'
+    assert list(view.rows()) == []
+    assert view.merge(first) == 'applied'  # releases the two held back
+    assert list(view.rows()) == [('centro', '-18', 'Pistachio', 4.0)]
+    assert view.position('centro') == (log.log_id, third['seq'])
+    for bundle in (first, second, third):
+        assert view.merge(bundle) == 'duplicate'
+    assert list(view.rows()) == [('centro', '-18', 'Pistachio', 4.0)]
+    view.close()
+
+
+def test_replaced_log_wins(tmp_path):
+    old = ChangeLog(str(tmp_path / 'old'), 'centro')
+    rows = changes(old, 1.0)
+    old_snapshot = make_bundle(old, None, lambda: dict(rows))
+    rows = changes(old, 2.0)
+    old_changes = make_bundle(old, old_snapshot['seq'], lambda: dict(rows))
+    new = ChangeLog(str(tmp_path / 'new'), 'centro')  # e.g. reinstalled from a backup
+    new.created = old.created + 1  # not left to the clock's resolution
+    rows = changes(new, 7.0)
+    new_snapshot = make_bundle(new, None, lambda: dict(rows))
+
+    view = ConsolidatedView(str(tmp_path / 'consolidated.db'))
+    assert view.merge(old_snapshot) == 'applied'
+    assert view.merge(new_snapshot) == 'applied'
+    assert view.merge(old_changes) == 'stale'
+    assert list(view.rows()) == [('centro', '-18', 'Pistachio', 7.0)]
+    view.close()
+
+
+def test_two_writers_never_share_a_seq(tmp_path):
+    first = ChangeLog(str(tmp_path / 'log'), 'centro')
+    second = ChangeLog(str(tmp_path / 'log'))
+    seqs = [log.append({('-18', 'Pistachio'): float(n)}) for n in range(5) for log in (first, second)]
+    assert seqs == list(range(1, 11))
+    assert [change_set['seq'] for change_set in ChangeLog(str(tmp_path / 'log')).since(0)] == seqs
+
+
+def test_pruned_log_sends_a_snapshot(tmp_path, monkeypatch):
+    monkeypatch.setattr(sync, 'SEGMENT_SETS', 2)
+    log = ChangeLog(str(tmp_path / 'log'), 'centro')
+    rows = changes(log, 1.0, 2.0, 3.0, 4.0, 5.0)
+    assert log.prune(4) == 2
+    assert log.first_seq() == 5
+    assert make_bundle(log, 4, lambda: dict(rows))['from'] == 5
+    bundle = make_bundle(log, 1, lambda: dict(rows))
+    assert bundle['snapshot'] and bundle['changes'] == [['-18', 'Pistachio', 5.0]]
+
+
+def test_push_a_bundle_over_64_kib(tmp_path):
+    view = ConsolidatedView(str(tmp_path / 'consolidated.db'))
+    server = sync.SyncServer(view, '127.0.0.1', 0)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(server.start())
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    try:
+        log = ChangeLog(str(tmp_path / 'log'), 'centro')
+        rows = {('-18', f"Flavor {n:05d}"): float(n) for n in range(5000)}
+        assert sync.push(log, lambda: dict(rows), '127.0.0.1', server.port) == 'applied'
+        assert len(list(view.rows())) == 5000
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        server.server.close()
+        loop.close()
+        view.close()
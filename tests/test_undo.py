@@ -0,0 +1,57 @@
+import pytest
+from consumption import ConsumptionHistory
+from inventory_store import ConflictError, InventoryError, InventoryStore
+from storage import SqliteBackend
+
+KEY = ('-18', 'Pistachio')
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = InventoryStore(backend=SqliteBackend(str(tmp_path / 'inventory.db')),
+                           history=ConsumptionHistory(str(tmp_path / 'inventory.usage')))
+    yield store
+    store.close()
+
+
+def test_undo_and_redo(store):
+    store.add('-18', 'Pistachio', 5)
+    store.use('-18', 'Pistachio', 2)
+    assert store.undo() == 'use Pistachio'
+    assert store.get(KEY) == 5
+    assert store.undo() == 'add Pistachio'
+    assert KEY not in store
+    assert store.redo() == 'add Pistachio'
+    assert store.get(KEY) == 5
+    assert store.backend.load() == {KEY: 5}
+
+
+def test_undo_after_conflicting_edit_changes_nothing(store):
+    store.add('-18', 'Pistachio', 5)
+    store.apply({KEY: 2.0})  # another till sets the row in the meantime
+    with pytest.raises(ConflictError) as raised:
+        store.undo()
+    assert KEY in raised.value.versions
+    assert store.get(KEY) == 2.0
+    assert store.backend.load() == {KEY: 2.0}
+    # The entry stays put, so nothing is lost if the row goes back to what it was
+    assert store.undo_log.undo_label() == 'add Pistachio'
+    assert store.undo_log.redo_label() is None
+
+
+def test_redo_after_conflicting_edit_changes_nothing(store):
+    store.add('-18', 'Pistachio', 5)
+    store.undo()
+    store.apply({KEY: 3.0})  # another till adds the flavor again
+    with pytest.raises(ConflictError):
+        store.redo()
+    assert store.get(KEY) == 3.0
+    assert store.undo_log.redo_label() == 'add Pistachio'
+
+
+def test_new_change_clears_redo(store):
+    store.add('-18', 'Pistachio', 5)
+    store.undo()
+    store.add('-18', 'Pistachio', 1)
+    with pytest.raises(InventoryError):
+        store.redo()
@@ -0,0 +1,41 @@
+from collections import deque
+
+# Undo/redo log for the store. An entry holds one change set as a pair of
+# deltas over just the rows it touched: their quantities before (None for rows
+# it created) and after (None for rows it deleted). A cleared freezer costs two
+# values per row and nothing is ever copied wholesale. Undo applies `before`,
+# redo applies `after`, and either one first checks that the rows still hold
+# the other side, so a row changed since in some other way is never clobbered.
+
+UNDO_LIMIT = 100  # change sets that can be undone; older ones are forgotten
+
+
+class UndoEntry:
+    __slots__ = ('label', 'before', 'after', 'used')
+
+    def __init__(self, label, before, after, used):
+        self.label = label  # what the change was, e.g. "clear freezer -18"
+        self.before = before  # key -> quantity before the change, None if the row did not exist
+        self.after = after  # key -> quantity after the change, None if the row was deleted
+        self.used = used  # usage recorded by the change, to be taken back out on undo
+
+
+class UndoLog:
+    def __init__(self, limit=UNDO_LIMIT):
+        self.undo_stack = deque(maxlen=limit)
+        self.redo_stack = []
+
+    def record(self, entry):
+        # A fresh change makes the redo stack meaningless
+        self.undo_stack.append(entry)
+        self.redo_stack.clear()
+
+    def clear(self):
+        self.undo_stack.clear()
+        self.redo_stack.clear()
+
+    def undo_label(self):
+        return self.undo_stack[-1].label if self.undo_stack else None
+
+    def redo_label(self):
+        return self.redo_stack[-1].label if self.redo_stack else None
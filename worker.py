@@ -0,0 +1,82 @@
+import queue
+import threading
+import instrumentation
+
+# Runs slow work (disk I/O, pandas) on a single background thread so the Tk
+# mainloop never blocks. Jobs run one at a time in submission order; results
+# are handed back through a queue that the Tk thread drains with poll(),
+# typically from an after() loop, so callbacks always run on the Tk thread.
+
+
+class BackgroundWorker:
+    def __init__(self, name='inventory-worker'):
+        self.requests = queue.Queue()
+        self.results = queue.Queue()
+        self._lock = threading.Lock()
+        self._queued = set()  # coalesce keys of jobs waiting to start
+        self._pending = 0
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, fn, *args, callback=None, errback=None, coalesce=None):
+        # A job submitted with a coalesce key is dropped while an identical job is
+        # still waiting in the queue; jobs like "write everything pending" read the
+        # latest state when they run, so one queued copy covers them all.
+        with self._lock:
+            if coalesce is not None:
+                if coalesce in self._queued:
+                    return False
+                self._queued.add(coalesce)
+            self._pending += 1
+        self.requests.put((fn, args, callback, errback, coalesce))
+        return True
+
+    def pending(self):
+        with self._lock:
+            return self._pending
+
+    def _run(self):
+        while True:
+            job = self.requests.get()
+            if job is None:
+                break
+            fn, args, callback, errback, coalesce = job
+            if coalesce is not None:
+                with self._lock:
+                    self._queued.discard(coalesce)
+            try:
+                with instrumentation.span('worker.' + getattr(fn, '__name__', 'job')):
+                    result, error = instrumentation.profile_call(fn, *args), None
+            except Exception as e:
+                result, error = None, e
+            self.results.put((callback, errback, result, error))
+
+    def poll(self):
+        # Call from the Tk thread; runs the callbacks of every finished job
+        while True:
+            try:
+                callback, errback, result, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            with self._lock:
+                self._pending -= 1
+            if error is not None:
+                if errback is None:
+                    raise error
+                errback(error)
+            elif callback is not None:
+                callback(result)
+
+    def wait(self):
+        # Blocks until every job submitted so far has run, then runs their
+        # callbacks; the thread keeps going, unlike stop()
+        done = threading.Event()
+        self.submit(done.set)
+        done.wait()
+        self.poll()
+
+    def stop(self):
+        # Finishes everything already queued, then stops the thread
+        self.requests.put(None)
+        self._thread.join()
+        self.poll()